@@ -1,11 +1,26 @@
 import cv2
 import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from ultralytics import YOLO
+from redaction import redact_regions, make_kernel
+from models import load_model
 
-# Load YOLO models
-model_face = YOLO("yolov8n-face-lindevs.pt")   # face detection model
-model_idcard = YOLO("best.pt")                 # ID card detection model
+# Inference backend: torch, onnx or openvino ("python models.py" compares them)
+INFERENCE_BACKEND = 'torch'
+
+# Load YOLO models once - Streamlit reruns this script on every click,
+# so cache them instead of reloading on each rerun
+@st.cache_resource
+def load_models(backend):
+    model_face = load_model("yolov8n-face-lindevs.pt", backend)   # face detection model
+    model_idcard = load_model("best.pt", backend)                 # ID card detection model
+    return model_face, model_idcard
+
+# A (9, 9) blur was too weak to hide identity - pixelate with big blocks instead
+REDACTION_KERNEL = make_kernel('pixelate', 12)
+
+# Two worker threads so the face and ID card models run at the same time
+executor = ThreadPoolExecutor(max_workers=2)
 
 st.title("Real-Time Privacy Protection Demo")
 
@@ -16,6 +31,8 @@ ip_link = st.text_input("Enter your IP camera link (or 0 for webcam)", "")
 run_demo = st.checkbox("Run Detection")
 
 if run_demo and ip_link:
+    with st.spinner("Loading models..."):
+        model_face, model_idcard = load_models(INFERENCE_BACKEND)
     cap = cv2.VideoCapture(ip_link if ip_link != "0" else 0)
     stframe = st.empty()
 
@@ -29,29 +46,27 @@ if run_demo and ip_link:
         frame = cv2.resize(frame, (640, 480))
         output = frame.copy()
 
+        # Run both detectors in parallel
+        face_future = executor.submit(model_face.predict, frame, conf=0.3, verbose=False)
+        id_future = executor.submit(model_idcard.predict, frame, conf=0.5, verbose=False)
+
         # --- Face detection ---
-        results_face = model_face.predict(frame, conf=0.3, verbose=False)
-        for r in results_face:
-            for box in r.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                roi = output[y1:y2, x1:x2]
-                if roi.size > 0:
-                    roi_blur = cv2.GaussianBlur(roi, (9, 9), 5)
-                    output[y1:y2, x1:x2] = roi_blur
-                cv2.putText(output, "Face", (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        results_face = face_future.result()
+        face_boxes = [tuple(map(int, box.xyxy[0])) for r in results_face for box in r.boxes]
 
         # --- ID card detection ---
-        results_id = model_idcard.predict(frame, conf=0.5, verbose=False)
-        for r in results_id:
-            for box in r.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                roi = output[y1:y2, x1:x2]
-                if roi.size > 0:
-                    roi_blur = cv2.GaussianBlur(roi, (9, 9), 5)
-                    output[y1:y2, x1:x2] = roi_blur
-                cv2.putText(output, "ID Card", (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+        results_id = id_future.result()
+        id_boxes = [tuple(map(int, box.xyxy[0])) for r in results_id for box in r.boxes]
+
+        # Blur all faces and ID cards in one pass
+        redact_regions(output, [(face_boxes, REDACTION_KERNEL), (id_boxes, REDACTION_KERNEL)])
+
+        for (x1, y1, x2, y2) in face_boxes:
+            cv2.putText(output, "Face", (x1, y1 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        for (x1, y1, x2, y2) in id_boxes:
+            cv2.putText(output, "ID Card", (x1, y1 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
 
         # Show frame in Streamlit
         stframe.image(output, channels="BGR")
@@ -0,0 +1,153 @@
+"""
+ASGI Server Mode
+The Flask apps hold one OS thread per /video_feed viewer for the whole
+session. This module serves the same routes as a plain ASGI app, where each
+viewer is an async generator fed from the pipeline's frame broadcaster, so an
+asyncio server can hold thousands of idle or slow viewers.
+
+Run it with uvicorn (pip install uvicorn):
+    uvicorn simple_camera_app:asgi_app --host 0.0.0.0 --port 5000
+or set SERVER_MODE = 'asgi' at the top of the app.
+"""
+
+import asyncio
+import json
+
+MJPEG_CONTENT_TYPE = b'multipart/x-mixed-replace; boundary=frame'
+
+
+async def read_json(receive):
+    """The request body parsed as JSON ({} if empty or invalid)"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        return {}
+
+
+async def send_body(send, body, content_type, status=200):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, data, status=200):
+    await send_body(send, json.dumps(data).encode(), b'application/json', status)
+
+
+async def send_stream(receive, send, camera):
+    """Stream one camera as multipart JPEG until the viewer disconnects"""
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', MJPEG_CONTENT_TYPE),
+                            (b'cache-control', b'no-cache')]})
+
+    async def pump():
+        async for part in parts:
+            await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def watch_disconnect():
+        # Servers don't fail send() after a disconnect, so listen for it
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    parts = camera.stream_async()
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(watch_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await parts.aclose()  # Releases the camera
+
+
+def make_asgi_app(index_html, cameras, capture_pool, json_routes=None, text_routes=None,
+                  put_routes=None):
+    """ASGI app with the Flask apps' routes.
+    json_routes maps extra GET paths to functions that return a dict,
+    text_routes to functions that return plain text (like /metrics), and
+    put_routes to functions that take the JSON body and return (dict, status)."""
+    json_routes = json_routes or {}
+    text_routes = text_routes or {}
+    put_routes = put_routes or {}
+    index_body = index_html.encode()
+
+    async def set_camera(receive, send):
+        data = await read_json(receive)
+        url = data.get('url', '')
+        if not url:
+            await send_json(send, {'status': 'error', 'message': 'No URL provided'})
+            return
+
+        # The probe runs on a worker thread, so a dead camera only costs this request
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, capture_pool.probe, url):
+            await send_json(send, {'status': 'error', 'message': 'Cannot connect to camera URL'})
+            return
+
+        camera = cameras.add(url)
+        print(f"Camera {camera.id} set to: {url}")
+        await send_json(send, {'status': 'success', 'message': 'Camera connected',
+                               'camera_id': camera.id})
+
+    async def stop_camera(receive, send):
+        data = await read_json(receive)
+        camera_id = data.get('camera_id')
+
+        loop = asyncio.get_running_loop()
+        if camera_id:
+            if not await loop.run_in_executor(None, cameras.remove, camera_id):
+                await send_json(send, {'status': 'error', 'message': 'Unknown camera ID'}, 404)
+                return
+        else:
+            await loop.run_in_executor(None, cameras.remove_all)
+        print("Camera stopped")
+        await send_json(send, {'status': 'success'})
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    cameras.remove_all()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        path, method = scope['path'], scope['method']
+        if path == '/' and method == 'GET':
+            await send_body(send, index_body, b'text/html; charset=utf-8')
+        elif path == '/set_camera' and method == 'POST':
+            await set_camera(receive, send)
+        elif path == '/stop_camera' and method == 'POST':
+            await stop_camera(receive, send)
+        elif path == '/video_feed' or path.startswith('/video_feed/'):
+            camera_id = path[len('/video_feed/'):]
+            camera = cameras.get(camera_id) if camera_id else cameras.latest()
+            if camera is None:
+                await send_json(send, {'status': 'error', 'message': 'Unknown camera ID'}, 404)
+                return
+            await send_stream(receive, send, camera)
+        elif path in json_routes and method == 'GET':
+            await send_json(send, json_routes[path]())
+        elif path in text_routes and method == 'GET':
+            await send_body(send, text_routes[path]().encode(),
+                            b'text/plain; version=0.0.4; charset=utf-8')
+        elif path in put_routes and method in ('PUT', 'POST'):
+            data = await read_json(receive)
+            body, status = put_routes[path](data)
+            await send_json(send, body, status)
+        else:
+            await send_json(send, {'status': 'error', 'message': 'Not found'}, 404)
+
+    return app
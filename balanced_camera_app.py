@@ -5,24 +5,120 @@ Good speed + Good accuracy - Best of both worlds!
 
 from flask import Flask, render_template_string, Response, request, jsonify
 import cv2
-from ultralytics import YOLO
+import time
 import numpy as np
+from pipeline import FramePipeline
+from camera_manager import CameraManager
+from inference import BatchScheduler, result_boxes, upper_body_regions, detect_in_regions
+from tracking import BoxTracker, SpeakerSelector
+from redaction import redact_regions, make_kernel
+from buffers import copy_into, rss_bytes
+from encoding import default_pool
+from change_detection import ChangeDetector
+from models import load_model, warmup, max_batch_size, ModelLoader
+from capture import CapturePool
+from asgi import make_asgi_app
+from workers import ProcessWorkerPool, in_worker
+from settings import StreamSettings
+from governor import QualityGovernor, enforce_floor
+import metrics
 
 app = Flask(__name__)
 
-print("Loading models...")
-model_face = YOLO("yolov8n-face-lindevs.pt")
-model_idcard = YOLO("best.pt")
-print("Models loaded!")
-
-current_camera_url = None
-
 # ADJUSTABLE SETTINGS - Change these for your needs!
 PROCESS_EVERY_N_FRAMES = 2  # Process every 2nd frame (1=all frames, 2=every 2nd, 3=every 3rd)
+TRACKING_MODE = True        # Stream every frame: detect every K frames, track in between
+DETECT_EVERY_K_FRAMES = 3   # Used by TRACKING_MODE instead of PROCESS_EVERY_N_FRAMES
+SPEAKER_SWITCH_FRAMES = 15  # Another face must be the biggest this many frames to become speaker
 RESOLUTION_WIDTH = 480      # 480 is balanced (320=fast, 640=accurate)
 FACE_CONFIDENCE = 0.4       # 0.3=more detections, 0.6=fewer but accurate
 ID_CONFIDENCE = 0.5         # Same as above
 BLUR_STRENGTH = 17          # 11=light blur (fast), 25=heavy blur (slow)
+FACE_KERNEL = 'gaussian'    # gaussian, box, pixelate, resize or fill ("python redaction.py" compares speed)
+ID_KERNEL = 'gaussian'      # Same choices as FACE_KERNEL
+JPEG_ENCODER = 'auto'       # auto, turbojpeg, pil or opencv
+SKIP_UNCHANGED_FRAMES = True  # Reuse the last result when the scene is static
+CASCADE_ID_DETECTION = False  # Only look for ID cards around detected people (faster)
+MAX_BATCH_SIZE = 8          # Frames from all cameras run through the model together
+MAX_BATCH_WAIT_MS = 10      # Longest a frame waits for the batch to fill up
+INFERENCE_BACKEND = 'torch' # torch, onnx or openvino ("python models.py" compares them)
+MODEL_PRECISION = 'fp32'    # fp32, fp16 or int8 (fp16 / int8 need openvino)
+WARMUP_ON_STARTUP = True    # Load models in the background at startup (False = on first stream)
+CAMERA_OPEN_TIMEOUT = 5.0   # Longest /set_camera waits for a camera to answer (seconds)
+SERVER_MODE = 'threaded'    # threaded (Flask) or asgi (uvicorn - holds thousands of viewers)
+PROCESS_WORKERS = 0         # Detect + blur in this many processes (0 = threads here; helps CPU-only boxes)
+THREADS_PER_WORKER = 1      # CPU cores each worker's model may use
+
+# QUALITY GOVERNOR - lowers resolution / detects less often when the machine can't keep up
+# (change it live per camera with PUT /governor)
+GOVERNOR = False            # Start new cameras with the governor on
+TARGET_FPS = 15             # Frames per second to hold
+LATENCY_BUDGET_MS = 300     # Capture-to-viewer time most frames must stay under
+MAX_RESOLUTION_WIDTH = 640  # Biggest resolution it (or you) may switch to
+PRIVACY_MIN_RESOLUTION = 320   # Privacy floor: never smaller, faces get too small to detect
+PRIVACY_MAX_DETECT_EVERY = 4   # Privacy floor: never fewer full detections than every 4th frame
+
+# What can change while a camera runs: (type, lowest, highest)
+SETTINGS_LIMITS = {
+    'face_confidence': (float, 0.05, 0.95),
+    'id_confidence': (float, 0.05, 0.95),
+    'blur_strength': (int, 11, 99),  # Below 11 pixelate / resize leave faces recognizable
+    'resolution': (int, 160, MAX_RESOLUTION_WIDTH),
+    'detect_every': (int, 1, 30),
+    'governor': (bool, None, None),
+    'target_fps': (float, 1, 60),
+    'latency_budget_ms': (float, 10, 10000),
+    # The API can only tighten the privacy floor, never loosen it
+    'min_resolution': (int, PRIVACY_MIN_RESOLUTION, MAX_RESOLUTION_WIDTH),
+    'max_detect_every': (int, 1, PRIVACY_MAX_DETECT_EVERY),
+}
+GOVERNOR_SETTINGS = ('governor', 'target_fps', 'latency_budget_ms',
+                     'min_resolution', 'max_detect_every')
+LIVE_SETTINGS = ('face_confidence', 'id_confidence', 'blur_strength', 'resolution')  # PUT /settings
+
+def make_settings():
+    """Live settings of a new camera, starting from the values above"""
+    return StreamSettings(SETTINGS_LIMITS,
+                          face_confidence=FACE_CONFIDENCE,
+                          id_confidence=ID_CONFIDENCE,
+                          blur_strength=BLUR_STRENGTH,
+                          resolution=RESOLUTION_WIDTH,
+                          detect_every=DETECT_EVERY_K_FRAMES if TRACKING_MODE else 1,
+                          governor=GOVERNOR,
+                          target_fps=TARGET_FPS,
+                          latency_budget_ms=LATENCY_BUDGET_MS,
+                          min_resolution=PRIVACY_MIN_RESOLUTION,
+                          max_detect_every=PRIVACY_MAX_DETECT_EVERY)
+
+def load_models():
+    """Exported models get a fixed RESOLUTION_WIDTH x RESOLUTION_WIDTH input"""
+    model_face = load_model("yolov8n-face-lindevs.pt", INFERENCE_BACKEND, RESOLUTION_WIDTH, MODEL_PRECISION)
+    model_idcard = load_model("best.pt", INFERENCE_BACKEND, RESOLUTION_WIDTH, MODEL_PRECISION)
+    warmup(model_face, RESOLUTION_WIDTH)
+    warmup(model_idcard, RESOLUTION_WIDTH)
+    return model_face, model_idcard
+
+# The page is served right away; streams wait until the models are ready
+models = ModelLoader(load_models)
+if WARMUP_ON_STARTUP and (not PROCESS_WORKERS or in_worker()):  # Workers need them, not us
+    models.start()
+
+# Exported models only take one frame at a time
+batch_size = max_batch_size(INFERENCE_BACKEND) or MAX_BATCH_SIZE
+
+# Results come back as box lists. detect() passes each request's ID card size
+# limits, since they depend on the stream's current resolution.
+face_scheduler = BatchScheduler(None, batch_size, MAX_BATCH_WAIT_MS,
+                                postprocess=result_boxes,
+                                model_loader=lambda: models.get()[0])
+idcard_scheduler = BatchScheduler(None, batch_size, MAX_BATCH_WAIT_MS,
+                                  postprocess=result_boxes,
+                                  model_loader=lambda: models.get()[1])
+
+face_kernel = make_kernel(FACE_KERNEL, BLUR_STRENGTH)
+id_kernel = make_kernel(ID_KERNEL, 31)  # Strong for IDs
+encoder_pool = default_pool(JPEG_ENCODER)
+capture_pool = CapturePool(CAMERA_OPEN_TIMEOUT)  # The stream reuses the probe's connection
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -77,6 +173,17 @@ HTML_TEMPLATE = """
             font-weight: bold;
             color: #f59e0b;
         }
+        .setting-input {
+            flex: 0 0 110px;
+            padding: 6px 10px;
+            font-size: 14px;
+            border: 2px solid #fcd34d;
+        }
+        .apply-btn {
+            margin-top: 10px;
+            padding: 8px 25px;
+            font-size: 14px;
+        }
         .input-section {
             background: #f8f9ff;
             padding: 30px;
@@ -159,24 +266,33 @@ HTML_TEMPLATE = """
         
         <div class="settings-box">
             <h3>⚙️ Current Settings:</h3>
+            <div class="setting-item">
+                <span>Measured Speed:</span>
+                <span class="setting-value" id="fps">Not streaming</span>
+            </div>
             <div class="setting-item">
                 <span>Frame Processing:</span>
-                <span class="setting-value">Every 2nd frame</span>
+                <span class="setting-value" id="detectEvery">-</span>
             </div>
             <div class="setting-item">
-                <span>Resolution:</span>
-                <span class="setting-value">480x360 (Balanced)</span>
+                <span>Resolution (width, 320=fast, 640=accurate):</span>
+                <input class="setting-input" type="number" id="resolution" step="32">
             </div>
             <div class="setting-item">
-                <span>Face Detection:</span>
-                <span class="setting-value">Confidence 40% (Good accuracy)</span>
+                <span>Face Confidence (0.3=more detections, 0.6=fewer):</span>
+                <input class="setting-input" type="number" id="faceConfidence" step="0.05">
             </div>
             <div class="setting-item">
-                <span>Blur Quality:</span>
-                <span class="setting-value">Medium (Fast + Effective)</span>
+                <span>ID Card Confidence:</span>
+                <input class="setting-input" type="number" id="idConfidence" step="0.05">
             </div>
-            <div style="margin-top: 10px; font-size: 14px; color: #78350f;">
-                💡 Want to adjust? Edit the settings at the top of the Python file!
+            <div class="setting-item">
+                <span>Blur Strength (11=light, 25=heavy):</span>
+                <input class="setting-input" type="number" id="blurStrength" step="2" min="11" max="99">
+            </div>
+            <button class="apply-btn" onclick="applySettings()">✔️ Apply</button>
+            <div style="margin-top: 10px; font-size: 14px; color: #78350f;" id="settingsMessage">
+                💡 Changes apply to the stream on the next frame - no restart needed
             </div>
         </div>
         
@@ -200,7 +316,7 @@ HTML_TEMPLATE = """
             <button class="stop-btn" onclick="stopCamera()">⏹️ Stop Stream</button>
             
             <div style="margin-top: 20px;">
-                <img id="videoStream" src="/video_feed" style="display: none;">
+                <img id="videoStream" src="" style="display: none;">
             </div>
             
             <div class="info-box">
@@ -214,6 +330,76 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
+        let cameraId = null;
+
+        // Live settings: shown for the current camera, or what a new camera starts with
+        const settingInputs = {
+            resolution: 'resolution',
+            face_confidence: 'faceConfidence',
+            id_confidence: 'idConfidence',
+            blur_strength: 'blurStrength'
+        };
+        // Only settings typed in since the last apply are sent - an untouched
+        // resolution must not count as picked by hand (that turns the governor off)
+        const editedSettings = new Set();
+        for (const [name, id] of Object.entries(settingInputs)) {
+            document.getElementById(id).addEventListener('input', () => editedSettings.add(name));
+        }
+
+        function refreshSettings() {
+            fetch('/settings')
+            .then(response => response.json())
+            .then(data => {
+                const live = cameraId && data.cameras[cameraId];
+                const settings = live || data.defaults;
+                for (const [name, id] of Object.entries(settingInputs)) {
+                    const input = document.getElementById(id);
+                    if (!editedSettings.has(name)) {  // Don't overwrite what was typed
+                        input.value = settings[name];
+                    }
+                }
+                document.getElementById('detectEvery').textContent = settings.detect_every > 1
+                    ? 'Every frame (detect every ' + settings.detect_every + ', track between)'
+                    : 'Every frame (detect on each)';
+                document.getElementById('fps').textContent = live && live.fps !== null
+                    ? live.fps.toFixed(1) + ' fps' + (live.governor ? ' (governor on)' : '')
+                    : 'Not streaming';
+            })
+            .catch(() => {});
+        }
+        setInterval(refreshSettings, 1000);
+        refreshSettings();
+
+        function applySettings() {
+            if (!cameraId) {
+                alert('Start a stream first!');
+                return;
+            }
+            if (editedSettings.size === 0) {
+                document.getElementById('settingsMessage').textContent = 'Nothing changed';
+                return;
+            }
+            const body = {camera_id: cameraId};
+            for (const name of editedSettings) {
+                body[name] = parseFloat(document.getElementById(settingInputs[name]).value);
+            }
+            fetch('/settings', {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(body)
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status === 'success') {
+                    editedSettings.clear();  // Show what the stream runs with again
+                }
+                document.getElementById('settingsMessage').textContent = data.status === 'success'
+                    ? '✅ Applied on the next frame'
+                    : '⚠️ ' + data.message;
+                refreshSettings();
+            });
+        }
+
         function startCamera() {
             const url = document.getElementById('cameraUrl').value;
             
@@ -230,9 +416,10 @@ HTML_TEMPLATE = """
             .then(response => response.json())
             .then(data => {
                 if (data.status === 'success') {
+                    cameraId = data.camera_id;
                     document.getElementById('videoContainer').classList.add('active');
                     document.getElementById('videoStream').style.display = 'block';
-                    document.getElementById('videoStream').src = '/video_feed?' + new Date().getTime();
+                    document.getElementById('videoStream').src = '/video_feed/' + cameraId + '?' + new Date().getTime();
                     document.getElementById('status').textContent = '🟢 Live - Balanced Mode';
                     document.getElementById('status').style.background = '#10b981';
                 } else {
@@ -245,8 +432,13 @@ HTML_TEMPLATE = """
         }
 
         function stopCamera() {
-            fetch('/stop_camera', {method: 'POST'})
+            fetch('/stop_camera', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({camera_id: cameraId})
+            })
             .then(() => {
+                cameraId = null;
                 document.getElementById('videoContainer').classList.remove('active');
                 document.getElementById('videoStream').style.display = 'none';
                 document.getElementById('status').textContent = 'Stopped';
@@ -258,123 +450,217 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def process_frame(frame):
-    """Balanced processing - good speed + good accuracy"""
-    output = frame.copy()
+def inference_size(frame):
+    """Model input size: the frame width, or the fixed size of an exported model"""
+    return frame.shape[1] if INFERENCE_BACKEND == 'torch' else RESOLUTION_WIDTH
+
+def detect(frame, face_confidence=FACE_CONFIDENCE, id_confidence=ID_CONFIDENCE):
+    """Run both detectors. Returns (face_boxes, id_boxes)"""
+    start = time.perf_counter()
+    imgsz = inference_size(frame)
+    # Unrealistic ID card sizes are dropped by result_boxes in the scheduler thread
+    # (the limits are for RESOLUTION_WIDTH frames)
+    scale = (frame.shape[1] / RESOLUTION_WIDTH) ** 2
+    id_sizes = {'min_area': 800 * scale, 'max_area': 80000 * scale}
+    # Start face and ID card detection together - both models run in parallel
+    face_future = face_scheduler.submit(
+        frame,
+        conf=face_confidence,  # 0.4 = balanced
+        imgsz=imgsz
+    )
+    if not CASCADE_ID_DETECTION:
+        id_future = idcard_scheduler.submit(
+            frame,
+            postprocess_args=id_sizes,
+            conf=id_confidence,  # 0.5 = balanced
+            imgsz=imgsz
+        )
     
     # Face detection with balanced confidence
-    results_face = model_face.predict(
-        source=frame, 
-        conf=FACE_CONFIDENCE,  # 0.4 = balanced
-        verbose=False, 
-        imgsz=RESOLUTION_WIDTH
-    )
-    face_boxes = []
+    face_boxes = face_future.result()
+    metrics.record('face_detect', time.perf_counter() - start)
     
-    for r in results_face:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            face_boxes.append((x1, y1, x2, y2))
+    # ID card detection with balanced confidence (unrealistic sizes already skipped)
+    if CASCADE_ID_DETECTION:
+        # Only crops around people, batched together
+        regions = upper_body_regions(face_boxes, frame.shape)
+        id_boxes = detect_in_regions(idcard_scheduler, frame, regions,
+                                     postprocess_args=id_sizes,
+                                     conf=id_confidence, imgsz=imgsz)
+    else:
+        id_boxes = id_future.result()
+
+    metrics.record('id_detect', time.perf_counter() - start)  # Both models overlap
+    
+    return face_boxes, id_boxes
+
+def redact(frame, face_boxes, id_boxes, speaker_index, output=None, face_kernel=face_kernel):
+    """Blur background faces and ID cards, draw the boxes"""
+    output = copy_into(frame, output)
+    start = time.perf_counter()
+    metrics.count('faces', len(face_boxes))
+    metrics.count('id_cards', len(id_boxes))
     
-    # Find largest face
-    largest_box = None
-    if face_boxes:
-        largest_box = max(face_boxes, key=lambda b: (b[2]-b[0])*(b[3]-b[1]))
+    # Blur background faces and ID cards - one pass per class
+    background = [b for i, b in enumerate(face_boxes) if i != speaker_index]
+    redact_regions(output, [
+        (background, face_kernel),  # Balanced blur for faces
+        (id_boxes, id_kernel),      # Strong blur for IDs
+    ])
     
-    # Process faces
-    for (x1, y1, x2, y2) in face_boxes:
-        if largest_box and (x1, y1, x2, y2) == largest_box:
+    # Draw face boxes
+    for i, (x1, y1, x2, y2) in enumerate(face_boxes):
+        if i == speaker_index:
             # Main speaker - green box
             cv2.rectangle(output, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(output, "Speaker", (x1, y1 - 10),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
         else:
-            # Background - blur with balanced strength
-            roi = output[y1:y2, x1:x2]
-            if roi.size > 0:
-                # Gaussian blur with balanced kernel
-                roi_blur = cv2.GaussianBlur(roi, (BLUR_STRENGTH, BLUR_STRENGTH), 15)
-                output[y1:y2, x1:x2] = roi_blur
+            # Background - red box
             cv2.rectangle(output, (x1, y1), (x2, y2), (0, 0, 255), 2)
             cv2.putText(output, "Person", (x1, y1 - 10),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
     
-    # ID card detection with balanced confidence
-    results_id = model_idcard.predict(
-        source=frame,
-        conf=ID_CONFIDENCE,  # 0.5 = balanced
-        verbose=False,
-        imgsz=RESOLUTION_WIDTH
-    )
-    
-    for r in results_id:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            w, h = x2 - x1, y2 - y1
-            area = w * h
-            
-            # Skip unrealistic sizes
-            if area < 800 or area > 80000:
-                continue
-            
-            # Blur ID card with strong blur
-            roi = output[y1:y2, x1:x2]
-            if roi.size > 0:
-                roi_blur = cv2.GaussianBlur(roi, (31, 31), 30)  # Strong blur for IDs
-                output[y1:y2, x1:x2] = roi_blur
-            
-            cv2.rectangle(output, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            cv2.putText(output, f"ID Card", (x1, y1 - 10),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+    # Draw ID card boxes
+    for (x1, y1, x2, y2) in id_boxes:
+        cv2.rectangle(output, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(output, f"ID Card", (x1, y1 - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+    metrics.record('redact', time.perf_counter() - start)
     
     return output
 
-def generate_frames():
-    """Balanced frame generation"""
-    global current_camera_url
+class StreamProcessor:
+    """Per-camera processing state.
+    Keeps the same speaker across frames, and in TRACKING_MODE detects every
+    K frames and tracks boxes in between. Every frame is still blurred.
+    K, the confidences and the blur strength come from the camera's live
+    settings, so they can change from one frame to the next."""
     
-    if not current_camera_url:
-        return
+    def __init__(self, settings):
+        self.settings = settings
+        self.frame_count = 0
+        self.tracker = BoxTracker()
+        self.face_count = 0
+        self.speaker = SpeakerSelector(SPEAKER_SWITCH_FRAMES)
+        self.shape = None
+        self.blur_strength = BLUR_STRENGTH
+        self.face_kernel = face_kernel
+        self.last_boxes = ([], [], None)
     
-    cap = cv2.VideoCapture(current_camera_url)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)
-    
-    if not cap.isOpened():
-        print(f"Error: Cannot open camera URL: {current_camera_url}")
-        return
+    def __call__(self, frame, output=None):
+        values = self.settings.snapshot()  # The same settings for the whole frame
+        if values['blur_strength'] != self.blur_strength:
+            self.blur_strength = values['blur_strength']
+            self.face_kernel = make_kernel(FACE_KERNEL, self.blur_strength)
+        # A new resolution moves every box, so detect again right away
+        resized = frame.shape != self.shape
+        self.shape = frame.shape
+        if resized or self.frame_count % values['detect_every'] == 0:
+            # Full YOLO detection
+            face_boxes, id_boxes = detect(frame, values['face_confidence'], values['id_confidence'])
+            self.tracker.reset(frame, face_boxes + id_boxes)
+            self.face_count = len(face_boxes)
+        else:
+            # Cheap optical flow tracking of the last boxes
+            start = time.perf_counter()
+            boxes = self.tracker.update(frame)
+            metrics.record('track', time.perf_counter() - start)
+            face_boxes, id_boxes = boxes[:self.face_count], boxes[self.face_count:]
+        
+        self.frame_count += 1
+        speaker_index = self.speaker.update(face_boxes)
+        self.last_boxes = (face_boxes, id_boxes, speaker_index)  # For leakage_eval.py
+        return redact(frame, face_boxes, id_boxes, speaker_index, output, self.face_kernel)
+
+def make_processor():
+    """Each camera needs its own processor to remember its speaker.
+    With PROCESS_WORKERS this runs inside a worker process, and the camera's
+    settings arrive with each frame.
+    In TRACKING_MODE every frame is processed and detection runs every K frames."""
+    return StreamProcessor(make_settings())
+
+worker_pool = None
+
+def get_worker_pool():
+    """The worker processes, started when the first camera needs them"""
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = ProcessWorkerPool('balanced_camera_app:make_processor', PROCESS_WORKERS,
+                                        THREADS_PER_WORKER)
+    return worker_pool
+
+def make_pipeline(url, settings):
+    """Build the capture + AI pipeline for one camera (models are shared).
+    settings are the camera's live settings - they outlive the pipeline."""
+    height = int(RESOLUTION_WIDTH * 3 / 4)  # Maintain 4:3 aspect ratio
+    if PROCESS_WORKERS:
+        process = get_worker_pool().processor(settings)
+    else:
+        process = StreamProcessor(settings)
+    change_detector = ChangeDetector() if SKIP_UNCHANGED_FRAMES else None
+    # Without TRACKING_MODE only the resolution is tuned
+    governor = QualityGovernor(settings, tune_interval=TRACKING_MODE)
+    return FramePipeline(url, process,
+                         (RESOLUTION_WIDTH, height),
+                         jpeg_quality=70,
+                         process_every_n=1 if TRACKING_MODE else PROCESS_EVERY_N_FRAMES,
+                         buffer_size=2,
+                         encoder=encoder_pool,
+                         change_detector=change_detector,
+                         capture_pool=capture_pool,
+                         settings=settings,
+                         max_size=(MAX_RESOLUTION_WIDTH, int(MAX_RESOLUTION_WIDTH * 3 / 4)),
+                         governor=governor)
+
+# Every camera gets its own ID, live settings and pipeline
+cameras = CameraManager(make_pipeline, make_settings)
+
+def governor_state():
+    """Governor settings, current quality and last decision of every camera"""
+    state = {}
+    for camera in list(cameras.cameras.values()):
+        values = camera.settings.snapshot()
+        info = {name: values[name] for name in GOVERNOR_SETTINGS + ('resolution', 'detect_every')}
+        pipeline = camera.pipeline
+        info['status'] = pipeline.governor.status if pipeline else {'state': 'stopped'}
+        state[camera.id] = info
+    return {'status': 'success', 'cameras': state}
+
+def update_governor(data):
+    """Change the governor of one camera (camera_id) or of every camera.
+    Returns (response, HTTP status)"""
+    if not isinstance(data, dict):
+        return {'status': 'error', 'message': 'Expected a JSON object'}, 400
+    changes = dict(data)
+    camera_id = changes.pop('camera_id', None)
+    unknown = set(changes) - set(GOVERNOR_SETTINGS)
+    if unknown:
+        return {'status': 'error', 'message': f"Not a governor setting: {', '.join(sorted(unknown))}"}, 400
     
-    print(f"Connected to camera: {current_camera_url}")
-    frame_count = 0
+    if camera_id:
+        camera = cameras.get(camera_id)
+        if camera is None:
+            return {'status': 'error', 'message': 'Unknown camera ID'}, 404
+        targets = [camera]
+    else:
+        targets = list(cameras.cameras.values())
     
+    # With no camera yet, a bad value is still an error
     try:
-        while current_camera_url:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_count += 1
-            
-            # Process every Nth frame based on settings
-            if frame_count % PROCESS_EVERY_N_FRAMES != 0:
-                continue
-            
-            # Resize to balanced resolution
-            height = int(RESOLUTION_WIDTH * 3 / 4)  # Maintain 4:3 aspect ratio
-            frame = cv2.resize(frame, (RESOLUTION_WIDTH, height))
-            
-            # Process with AI
-            output = process_frame(frame)
-            
-            # Encode with good quality
-            _, buffer = cv2.imencode('.jpg', output, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            frame_bytes = buffer.tobytes()
-            
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-    finally:
-        cap.release()
-        print("Camera released")
+        changes = (targets[0].settings if targets else make_settings()).validate(changes)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    for camera in targets:
+        camera.settings.update(**changes)
+        enforce_floor(camera.settings)  # A higher floor applies on the next frame
+    return governor_state(), 200
+
+def generate_frames(camera):
+    """Balanced frame generation"""
+    # One capture + AI pipeline per camera is shared by every viewer,
+    # and its chunks arrive already wrapped in the multipart format
+    yield from camera.stream()
 
 @app.route('/')
 def index():
@@ -382,48 +668,172 @@ def index():
 
 @app.route('/set_camera', methods=['POST'])
 def set_camera():
-    global current_camera_url
     data = request.json
     url = data.get('url', '')
     
     if not url:
         return jsonify({'status': 'error', 'message': 'No URL provided'})
     
-    test_cap = cv2.VideoCapture(url)
-    if not test_cap.isOpened():
-        test_cap.release()
+    if not capture_pool.probe(url):
         return jsonify({'status': 'error', 'message': 'Cannot connect to camera'})
-    test_cap.release()
     
-    current_camera_url = url
-    print(f"Camera URL set to: {url}")
+    camera = cameras.add(url)
+    print(f"Camera {camera.id} set to: {url}")
     
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'camera_id': camera.id})
 
 @app.route('/stop_camera', methods=['POST'])
 def stop_camera():
-    global current_camera_url
-    current_camera_url = None
+    data = request.get_json(silent=True) or {}
+    camera_id = data.get('camera_id')
+    
+    if camera_id:
+        if not cameras.remove(camera_id):
+            return jsonify({'status': 'error', 'message': 'Unknown camera ID'}), 404
+    else:
+        cameras.remove_all()
     return jsonify({'status': 'success'})
 
+@app.route('/cameras')
+def list_cameras():
+    return jsonify({'status': 'success', 'cameras': cameras.list(),
+                    'rss_bytes': rss_bytes()})
+
+@app.route('/stats')
+def stats():
+    return jsonify({'status': 'success', 'streams': cameras.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(cameras.stats()),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/status')
+def status():
+    return jsonify({'status': 'success', 'models': models.status()})
+
+def settings_state():
+    """Live settings and measured fps of every camera, and what new cameras start with"""
+    state = {}
+    for camera in list(cameras.cameras.values()):
+        values = camera.settings.snapshot()
+        info = {name: values[name] for name in LIVE_SETTINGS + ('detect_every', 'governor')}
+        pipeline = camera.pipeline
+        info['fps'] = pipeline.metrics.rates['published'].rate() if pipeline else None
+        state[camera.id] = info
+    defaults = make_settings().snapshot()
+    return {'status': 'success', 'cameras': state,
+            'defaults': {name: defaults[name] for name in LIVE_SETTINGS + ('detect_every', 'governor')}}
+
+def update_settings(data):
+    """Change the live settings of one camera (camera_id) or of every camera.
+    They apply together on the next frame - no model reload, no stream restart.
+    Returns (response, HTTP status)"""
+    if not isinstance(data, dict):
+        return {'status': 'error', 'message': 'Expected a JSON object'}, 400
+    changes = dict(data)
+    camera_id = changes.pop('camera_id', None)
+    unknown = set(changes) - set(LIVE_SETTINGS)
+    if unknown:
+        return {'status': 'error', 'message': f"Not a live setting: {', '.join(sorted(unknown))}"}, 400
+    
+    if camera_id:
+        camera = cameras.get(camera_id)
+        if camera is None:
+            return {'status': 'error', 'message': 'Unknown camera ID'}, 404
+        targets = [camera]
+    else:
+        targets = list(cameras.cameras.values())
+    
+    # Check everything first, so a bad value changes no camera at all
+    # (with no camera yet, against the settings a new camera starts with)
+    checked = [camera.settings for camera in targets] or [make_settings()]
+    try:
+        changes = checked[0].validate(changes)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    for settings in checked:
+        floor = settings.snapshot()['min_resolution']
+        if changes.get('resolution', floor) < floor:
+            return {'status': 'error',
+                    'message': f"resolution is below the privacy floor ({floor})"}, 400
+    
+    for camera in targets:
+        update = dict(changes)
+        current = camera.settings.snapshot()['resolution']
+        if update.get('resolution', current) != current:
+            update['governor'] = False  # A resolution picked by hand stays
+        camera.settings.update(**update)
+    return settings_state(), 200
+
+@app.route('/settings', methods=['GET', 'PUT'])
+def live_settings():
+    if request.method == 'PUT':
+        body, code = update_settings(request.get_json(silent=True) or {})
+        return jsonify(body), code
+    return jsonify(settings_state())
+
+@app.route('/governor', methods=['GET', 'PUT'])
+def governor():
+    if request.method == 'PUT':
+        body, code = update_governor(request.get_json(silent=True) or {})
+        return jsonify(body), code
+    return jsonify(governor_state())
+
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id):
+    camera = cameras.get(camera_id)
+    if camera is None:
+        return jsonify({'status': 'error', 'message': 'Unknown camera ID'}), 404
+    return Response(generate_frames(camera),
+                   mimetype='multipart/x-mixed-replace; boundary=frame')
+
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(),
+def latest_video_feed():
+    camera = cameras.latest()
+    if camera is None:
+        return jsonify({'status': 'error', 'message': 'No camera set'}), 404
+    return Response(generate_frames(camera),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
+# The same routes for an asyncio server: uvicorn balanced_camera_app:asgi_app
+asgi_app = make_asgi_app(HTML_TEMPLATE, cameras, capture_pool, {
+    '/cameras': lambda: {'status': 'success', 'cameras': cameras.list(),
+                         'rss_bytes': rss_bytes()},
+    '/status': lambda: {'status': 'success', 'models': models.status()},
+    '/stats': lambda: {'status': 'success', 'streams': cameras.stats()},
+    '/governor': governor_state,
+    '/settings': settings_state,
+}, text_routes={
+    '/metrics': lambda: metrics.render_prometheus(cameras.stats()),
+}, put_routes={
+    '/governor': update_governor,
+    '/settings': update_settings,
+})
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("⚖️  Privacy Blur - BALANCED Mode")
     print("="*60)
     print("\n📊 Settings:")
-    print(f"   • Process every {PROCESS_EVERY_N_FRAMES} frames")
+    if TRACKING_MODE:
+        print(f"   • Detect every {DETECT_EVERY_K_FRAMES} frames, track in between")
+    else:
+        print(f"   • Process every {PROCESS_EVERY_N_FRAMES} frames")
     print(f"   • Resolution: {RESOLUTION_WIDTH}x{int(RESOLUTION_WIDTH*3/4)}")
     print(f"   • Face confidence: {FACE_CONFIDENCE*100}%")
     print(f"   • ID confidence: {ID_CONFIDENCE*100}%")
     print(f"   • Blur strength: {BLUR_STRENGTH}")
+    if GOVERNOR:
+        print(f"   • Governor: hold {TARGET_FPS} fps, {LATENCY_BUDGET_MS} ms "
+              f"(never below {PRIVACY_MIN_RESOLUTION}px or detect every {PRIVACY_MAX_DETECT_EVERY})")
     print("\n✅ Server starting...")
     print("📱 Open: http://localhost:5000")
-    print("\n💡 To adjust settings, edit the variables at the top of this file")
+    print("\n💡 Confidences, blur and resolution can be changed live on the page (or PUT /settings)")
     print("\n⏹️  Press Ctrl+C to stop\n")
     
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    if SERVER_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,334 @@
+"""
+Offline Batch Redaction
+Redacts recorded video files with the same face / ID card logic as the live
+apps: background faces and ID cards are blurred, the main speaker stays visible.
+
+The input is split into chunks that start on keyframes (found with ffprobe),
+so each worker seeks straight to its chunk without decoding the frames before
+it. Chunks run in parallel worker processes, each running the models on
+batches of frames, and are written with a streaming encoder (ffmpeg when it is
+installed, OpenCV otherwise). Finished chunks stay in a work folder, so a run
+that crashed picks up at the first unfinished chunk. At the end the chunks are
+joined into the output, with the original audio when ffmpeg is available.
+
+    python batch_redact.py recording.mp4 redacted.mp4 --workers 4
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import time
+from multiprocessing import get_context
+import cv2
+import numpy as np
+
+from inference import result_boxes
+from models import load_model, max_batch_size, BACKENDS, PRECISIONS, SUPPORTED_PRECISIONS
+from redaction import redact_regions, make_kernel, KERNELS
+from tracking import SpeakerSelector
+
+FACE_WEIGHTS = "yolov8n-face-lindevs.pt"
+IDCARD_WEIGHTS = "best.pt"
+
+
+def video_info(path):
+    """fps, frame count and size of a video file"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"Cannot open {path}")
+    info = {
+        'fps': cap.get(cv2.CAP_PROP_FPS) or 30.0,
+        'frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+    cap.release()
+    return info
+
+
+def keyframes(path, fps):
+    """Frame numbers of the keyframes, or None without ffprobe"""
+    if not shutil.which('ffprobe'):
+        return None
+    # -skip_frame nokey only decodes the keyframes, so this is quick
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+           '-show_entries', 'stream=start_time:frame=pts_time', '-of', 'json', path]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        data = json.loads(out)
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+
+    def seconds(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):  # Missing or 'N/A'
+            return None
+
+    # Timestamps are absolute, but OpenCV counts frames from the stream's start
+    # (often not 0 in MP4 with B-frames and in MPEG-TS)
+    streams = data.get('streams') or [{}]
+    start = seconds(streams[0].get('start_time')) or 0.0
+    times = [seconds(frame.get('pts_time')) for frame in data.get('frames', [])]
+    frames = sorted({max(int(round((t - start) * fps)), 0) for t in times if t is not None})
+    return frames or None
+
+
+def plan_chunks(total_frames, chunk_frames, keyframe_list=None):
+    """[start, end] frame ranges of at least chunk_frames, each starting on a keyframe.
+    Without keyframes the ranges are just chunk_frames long.
+    The last chunk's end is None: it runs to the end of the file, because
+    the frame count in the header is not always exact."""
+    starts = keyframe_list or range(0, max(total_frames, 1), chunk_frames)
+    chunks = []
+    start = 0
+    for keyframe in starts:
+        if keyframe - start >= chunk_frames:
+            chunks.append([start, keyframe])
+            start = keyframe
+    chunks.append([start, None])
+    return chunks
+
+
+class StreamingWriter:
+    """Writes frames as they are produced - H.264 through ffmpeg if installed,
+    otherwise OpenCV's mp4v encoder"""
+
+    def __init__(self, path, fps, size):
+        width, height = size
+        self.proc = None
+        self.writer = None
+        if shutil.which('ffmpeg'):
+            self.proc = subprocess.Popen(
+                ['ffmpeg', '-loglevel', 'error', '-y',
+                 '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}',
+                 '-r', str(fps), '-i', '-',
+                 '-an', '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', path],
+                stdin=subprocess.PIPE)
+        else:
+            self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+    def write(self, frame):
+        if self.proc:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+        else:
+            self.writer.write(frame)
+
+    def close(self):
+        if self.proc:
+            self.proc.stdin.close()
+            if self.proc.wait() != 0:
+                raise RuntimeError("ffmpeg failed to encode the chunk")
+        else:
+            self.writer.release()
+
+
+# Models and settings of one worker process, loaded once by _init_worker
+_worker = {}
+
+
+def _init_worker(backend, precision, threads, settings):
+    # Limit torch to this worker's share of the cores (before it is imported)
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    cv2.setNumThreads(threads)
+    _worker['face'] = load_model(FACE_WEIGHTS, backend, settings['imgsz'], precision)
+    _worker['idcard'] = load_model(IDCARD_WEIGHTS, backend, settings['imgsz'], precision)
+    _worker['settings'] = settings
+
+
+def redact_chunk(job):
+    """Redact frames [start, end) of the input into one chunk file.
+    Returns (chunk index, frames written)"""
+    index, path, start, end, out_path, fps = job
+    s = _worker['settings']
+    face_kernel = make_kernel(s['kernel'], s['face_strength'])
+    id_kernel = make_kernel(s['kernel'], s['id_strength'])
+    speaker = SpeakerSelector(s['speaker_switch_frames']) if s['keep_speaker'] else None
+
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)  # Lands on a keyframe - no wasted decoding
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    # The ID card size limits of the live apps are for 640x480 frames
+    area_scale = size[0] * size[1] / (640 * 480)
+
+    partial_path = out_path + '.part.mp4'
+    writer = StreamingWriter(partial_path, fps, size)
+    done = 0
+    while end is None or start + done < end:
+        # Read a batch of frames and run each model on all of them at once
+        batch = []
+        while len(batch) < s['batch_size'] and (end is None or start + done + len(batch) < end):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            batch.append(frame)
+        if not batch:
+            break
+
+        face_results = _worker['face'].predict(batch, conf=s['face_conf'],
+                                               imgsz=s['imgsz'], verbose=False)
+        id_results = _worker['idcard'].predict(batch, conf=s['id_conf'],
+                                               imgsz=s['imgsz'], verbose=False)
+        for frame, face_result, id_result in zip(batch, face_results, id_results):
+            face_boxes = result_boxes(face_result)
+            id_boxes = result_boxes(id_result, min_area=1000 * area_scale,
+                                    max_area=100000 * area_scale)
+            speaker_index = speaker.update(face_boxes) if speaker else None
+            background = [b for i, b in enumerate(face_boxes) if i != speaker_index]
+            redact_regions(frame, [(background, face_kernel), (id_boxes, id_kernel)])
+            writer.write(frame)
+        done += len(batch)
+
+    cap.release()
+    writer.close()
+    os.replace(partial_path, out_path)  # Only finished chunks get their final name
+    return index, done
+
+
+def join_chunks(chunk_paths, output, source):
+    """Join the chunk files into the output video"""
+    if shutil.which('ffmpeg'):
+        list_path = output + '.chunks.txt'
+        with open(list_path, 'w') as f:
+            for path in chunk_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        base = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        # Same encoder settings in every chunk, so they join without re-encoding.
+        # Try to bring the original audio along; fall back to video only.
+        with_audio = base + ['-i', source, '-map', '0:v', '-map', '1:a?', '-c', 'copy', output]
+        if subprocess.run(with_audio).returncode != 0:
+            subprocess.run(base + ['-c', 'copy', output], check=True)
+        os.remove(list_path)
+        return
+
+    writer = None
+    for path in chunk_paths:
+        cap = cv2.VideoCapture(path)
+        if writer is None:
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'),
+                                     cap.get(cv2.CAP_PROP_FPS) or 30.0, size)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            writer.write(frame)
+        cap.release()
+    if writer is not None:
+        writer.release()
+
+
+def load_manifest(path, key):
+    """The saved chunk plan, if it was made for the same input and settings"""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('key') == key else None
+
+
+def save_manifest(path, manifest):
+    """Write the manifest in one step, so a crash never leaves half of it"""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def run(args):
+    info = video_info(args.input)
+    work_dir = args.work_dir or args.output + '.parts'
+    os.makedirs(work_dir, exist_ok=True)
+    manifest_path = os.path.join(work_dir, 'manifest.json')
+
+    batch_size = min(args.batch_size, max_batch_size(args.backend) or args.batch_size)
+    settings = {
+        'imgsz': args.imgsz, 'batch_size': batch_size,
+        'face_conf': args.face_conf, 'id_conf': args.id_conf,
+        'kernel': args.kernel, 'face_strength': args.face_strength,
+        'id_strength': args.id_strength, 'keep_speaker': not args.blur_all_faces,
+        'speaker_switch_frames': 15,
+    }
+    stat = os.stat(args.input)
+    key = {'input': os.path.abspath(args.input), 'size': stat.st_size,
+           'mtime': stat.st_mtime, 'chunk_frames': args.chunk_frames,
+           'settings': settings, 'backend': args.backend, 'precision': args.precision}
+
+    # Resume: reuse the chunk plan and skip chunks that already finished
+    manifest = load_manifest(manifest_path, key)
+    if manifest is None:
+        for name in os.listdir(work_dir):
+            if name.startswith('chunk_'):
+                os.remove(os.path.join(work_dir, name))
+        found = keyframes(args.input, info['fps'])
+        manifest = {'key': key, 'chunks': plan_chunks(info['frames'], args.chunk_frames, found),
+                    'keyframe_aligned': found is not None}
+        save_manifest(manifest_path, manifest)
+    done_frames = manifest.setdefault('frames', {})  # Frames written per finished chunk
+
+    chunks = manifest['chunks']
+    chunk_paths = [os.path.join(work_dir, f'chunk_{i:05d}.mp4') for i in range(len(chunks))]
+    jobs = [(i, args.input, start, end, chunk_paths[i], info['fps'])
+            for i, (start, end) in enumerate(chunks) if not os.path.exists(chunk_paths[i])]
+    todo = {job[0] for job in jobs}
+    resumed = sum(done_frames.get(str(i), 0) for i in range(len(chunks)) if i not in todo)
+    print(f"{args.input}: {info['frames']} frames at {info['fps']:.1f} fps, "
+          f"{info['width']}x{info['height']}")
+    print(f"{len(chunks)} chunks ({'keyframe aligned' if manifest['keyframe_aligned'] else 'fixed size'}), "
+          f"{len(chunks) - len(jobs)} already done, {args.workers} workers")
+
+    start_time = time.monotonic()
+    frames = 0
+    if jobs:
+        # spawn: every worker loads its own copy of the models once
+        context = get_context('spawn')
+        with context.Pool(args.workers, initializer=_init_worker,
+                          initargs=(args.backend, args.precision,
+                                    args.threads_per_worker, settings)) as pool:
+            for index, done in pool.imap_unordered(redact_chunk, jobs):
+                frames += done
+                done_frames[str(index)] = done
+                save_manifest(manifest_path, manifest)
+                elapsed = time.monotonic() - start_time
+                print(f"  chunk {index + 1}/{len(chunks)} done - "
+                      f"{frames} frames, {frames / elapsed:.1f} fps")
+
+    join_chunks(chunk_paths, args.output, args.input)
+    elapsed = time.monotonic() - start_time
+    print(f"Wrote {args.output}: {frames} frames redacted in {elapsed:.1f}s "
+          f"({frames / elapsed if elapsed else 0:.1f} fps)"
+          + (f", {resumed} frames resumed from an earlier run" if resumed else ""))
+    if not args.keep_chunks:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    cores = os.cpu_count() or 2
+    parser = argparse.ArgumentParser(description="Redact faces and ID cards in a recorded video")
+    parser.add_argument('input', help="video file to redact")
+    parser.add_argument('output', help="redacted video to write (.mp4)")
+    parser.add_argument('--workers', type=int, default=max(cores // 2, 1))
+    parser.add_argument('--threads-per-worker', type=int, default=2)
+    parser.add_argument('--chunk-frames', type=int, default=600,
+                        help="smallest chunk size; chunks end on the next keyframe")
+    parser.add_argument('--batch-size', type=int, default=8, help="frames per model call")
+    parser.add_argument('--backend', default='torch', choices=BACKENDS)
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--face-conf', type=float, default=0.3)
+    parser.add_argument('--id-conf', type=float, default=0.5)
+    parser.add_argument('--kernel', default='gaussian', choices=sorted(KERNELS))
+    parser.add_argument('--face-strength', type=int, default=23)
+    parser.add_argument('--id-strength', type=int, default=51)
+    parser.add_argument('--blur-all-faces', action='store_true',
+                        help="also blur the main speaker")
+    parser.add_argument('--work-dir', help="where finished chunks are kept (default: OUTPUT.parts)")
+    parser.add_argument('--keep-chunks', action='store_true',
+                        help="keep the chunk files after joining")
+    args = parser.parse_args()
+    if args.precision not in SUPPORTED_PRECISIONS[args.backend]:
+        parser.error(f"{args.backend} supports {', '.join(SUPPORTED_PRECISIONS[args.backend])}")
+    run(args)
@@ -0,0 +1,288 @@
+"""
+Pipeline Benchmark
+Replays a video file (or seeded synthetic frames) through the stages of
+balanced_camera_app.py - decode, resize, face + ID card detection, tracking,
+redaction and JPEG encode - once per configuration, and reports per-stage
+p50/p95/p99 latency, fps, CPU use and memory. Results are written as JSON so
+two runs can be compared:
+
+    python benchmark.py --video clip.mp4 --output before.json
+    python benchmark.py --video clip.mp4 --output after.json
+    python benchmark.py --compare before.json after.json
+
+Frames go through the app's own StreamProcessor with a configuration's values
+as its live settings, so the benchmark can't drift from the app. The models,
+backend and kernels are the ones set at the top of the app file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import defaultdict
+import cv2
+import numpy as np
+
+import balanced_camera_app as app
+import metrics
+from buffers import rss_bytes
+from encoding import make_encoder
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# Settings every configuration starts from (balanced_camera_app.py defaults)
+DEFAULTS = {
+    'resolution': app.RESOLUTION_WIDTH,
+    'process_every_n': 1,    # PROCESS_EVERY_N_FRAMES - skipped frames are never shown
+    'detect_every': 1,       # DETECT_EVERY_K_FRAMES - tracked in between
+    'face_confidence': app.FACE_CONFIDENCE,
+    'id_confidence': app.ID_CONFIDENCE,
+    'blur_strength': app.BLUR_STRENGTH,
+    'jpeg_quality': 70,
+    'keep_speaker': True,    # False = blur every face (for leakage_eval.py)
+}
+
+# The speed / accuracy trade-offs the app's comments describe
+CONFIGS = {
+    'fast': {'resolution': 320, 'process_every_n': 3, 'blur_strength': 11},
+    'balanced': {'resolution': 480, 'process_every_n': 2},
+    'balanced_tracking': {'resolution': 480, 'detect_every': 3},
+    'accurate': {'resolution': 640, 'face_confidence': 0.3, 'blur_strength': 25},
+}
+
+# Config values that are live settings of the app's StreamProcessor
+LIVE_SETTINGS = ('resolution', 'detect_every', 'face_confidence', 'id_confidence', 'blur_strength')
+
+
+class FrameSource:
+    """Frames from a video file, or seeded random frames when there is no file"""
+
+    def __init__(self, video=None, size=(1280, 720), seed=0, unique=30):
+        self.cap = None
+        if video:
+            self.cap = cv2.VideoCapture(video)
+            if not self.cap.isOpened():
+                raise SystemExit(f"Cannot open {video}")
+        else:
+            rng = np.random.default_rng(seed)
+            width, height = size
+            self.frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+                           for _ in range(unique)]
+            self.index = 0
+
+    def read(self):
+        """The next frame, or None at the end of the video"""
+        if self.cap is not None:
+            ret, frame = self.cap.read()
+            return frame if ret else None
+        frame = self.frames[self.index % len(self.frames)].copy()  # Stands in for decoding
+        self.index += 1
+        return frame
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class StageTimes:
+    """metrics sink (see metrics.bind) that keeps every timing, for exact percentiles"""
+
+    def __init__(self, times):
+        self.times = times
+        self.counters = defaultdict(int)
+
+    def observe(self, stage, seconds):
+        self.times[stage].append(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+
+class NoSpeaker:
+    """Stands in for the SpeakerSelector when every face must be blurred"""
+
+    def update(self, face_boxes):
+        return None
+
+
+def make_processor(config):
+    """The app's per-camera processor, with the config as its live settings"""
+    settings = app.make_settings()
+    settings.update(**{name: config[name] for name in LIVE_SETTINGS})
+    processor = app.StreamProcessor(settings)
+    if not config['keep_speaker']:
+        processor.speaker = NoSpeaker()
+    return processor
+
+
+def percentiles(seconds):
+    ms = np.array(seconds) * 1000.0
+    return {
+        'count': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def run_config(config, source, max_frames, encoder, on_output=None):
+    """Replay up to max_frames source frames through one configuration.
+    on_output(index, output, face_boxes, id_boxes) sees every frame that would
+    be shown to a viewer, with the boxes that were blurred, in resized coordinates."""
+    width = config['resolution']
+    size = (width, int(width * 3 / 4))  # Same 4:3 as the app
+    processor = make_processor(config)
+    times = defaultdict(list)
+    sink = StageTimes(times)
+    metrics.bind(sink)  # The app records its detect / track / redact timings here
+    output = None
+    read = shown = 0
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    while read < max_frames:
+        frame_start = time.perf_counter()
+        frame = source.read()
+        if frame is None:
+            break
+        times['decode'].append(time.perf_counter() - frame_start)
+        read += 1
+        if read % config['process_every_n'] != 0:
+            continue  # Skipped like the app does - never shown
+
+        t = time.perf_counter()
+        resized = cv2.resize(frame, size)
+        times['resize'].append(time.perf_counter() - t)
+
+        output = processor(resized, output)
+
+        t = time.perf_counter()
+        encoder.encode(output, config['jpeg_quality'])
+        times['encode'].append(time.perf_counter() - t)
+        times['frame'].append(time.perf_counter() - frame_start)
+        shown += 1
+        if on_output:
+            face_boxes, id_boxes, speaker_index = processor.last_boxes
+            background = [b for i, b in enumerate(face_boxes) if i != speaker_index]
+            on_output(read - 1, output, background, id_boxes)
+
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    metrics.bind(None)
+    return {
+        'config': config,
+        'frames_read': read,
+        'frames_shown': shown,
+        'input_fps': read / elapsed if elapsed else 0.0,
+        'output_fps': shown / elapsed if elapsed else 0.0,
+        'cpu_percent': 100.0 * cpu / elapsed if elapsed else 0.0,  # Over 100 = several cores
+        'rss_mb': rss_bytes() / 1e6,
+        'peak_rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                        if resource else None),
+        'stages': {stage: percentiles(values) for stage, values in times.items() if values},
+        'detections_per_frame': {name: sink.counters[name] / shown if shown else 0.0
+                                 for name in ('faces', 'id_cards')},
+    }
+
+
+def build_configs(names, overrides=None):
+    """{name: full config} for the chosen preset names plus optional JSON overrides"""
+    configs = {}
+    for name in names:
+        configs[name] = dict(DEFAULTS, **CONFIGS.get(name, {}))
+    for name, values in (overrides or {}).items():
+        configs[name] = dict(DEFAULTS, **values)
+    return configs
+
+
+def environment(args):
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'backend': app.INFERENCE_BACKEND,
+        'precision': app.MODEL_PRECISION,
+        'video': args.video,
+        'frames': args.frames,
+        'seed': args.seed,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(old_path, new_path, threshold):
+    """Print fps and p95 changes between two result files.
+    Returns True if some configuration got slower by more than threshold percent."""
+    with open(old_path) as f:
+        old = json.load(f)['results']
+    with open(new_path) as f:
+        new = json.load(f)['results']
+
+    regressed = False
+    print(f"{'config':<20}{'fps before':>12}{'fps after':>12}{'p95 before':>13}{'p95 after':>12}")
+    for name in sorted(set(old) & set(new)):
+        a, b = old[name], new[name]
+        fps_change = 100.0 * (b['output_fps'] - a['output_fps']) / a['output_fps'] if a['output_fps'] else 0.0
+        p95_a = a['stages'].get('frame', {}).get('p95_ms', 0.0)
+        p95_b = b['stages'].get('frame', {}).get('p95_ms', 0.0)
+        p95_change = 100.0 * (p95_b - p95_a) / p95_a if p95_a else 0.0
+        flag = ''
+        if fps_change < -threshold or p95_change > threshold:
+            flag = '  <-- slower'
+            regressed = True
+        print(f"{name:<20}{a['output_fps']:>12.1f}{b['output_fps']:>12.1f}"
+              f"{p95_a:>11.1f}ms{p95_b:>10.1f}ms{flag}")
+    return regressed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the redaction pipeline per configuration")
+    parser.add_argument('--video', help="video file to replay (default: synthetic frames)")
+    parser.add_argument('--frames', type=int, default=300, help="source frames per configuration")
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS),
+                        help=f"presets to run ({', '.join(CONFIGS)})")
+    parser.add_argument('--config-file', help="JSON file of {name: {setting: value}} to run too")
+    parser.add_argument('--encoder', default='opencv', help="JPEG encoder (see encoding.py)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for synthetic frames")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two result files instead of running")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="percent change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    overrides = None
+    if args.config_file:
+        with open(args.config_file) as f:
+            overrides = json.load(f)
+    configs = build_configs(args.configs, overrides)
+
+    app.models.get()  # Load and warm up before any timing starts
+    encoder = make_encoder(args.encoder)
+    results = {}
+    for name, config in configs.items():
+        source = FrameSource(args.video, seed=args.seed)
+        results[name] = run_config(config, source, args.frames, encoder)
+        source.close()
+
+        r = results[name]
+        print(f"\n{name}: {r['output_fps']:.1f} fps shown ({r['input_fps']:.1f} fps read), "
+              f"CPU {r['cpu_percent']:.0f}%, RSS {r['rss_mb']:.0f} MB")
+        print(f"  {'stage':<12}{'p50':>9}{'p95':>9}{'p99':>9}")
+        for stage, s in r['stages'].items():
+            print(f"  {stage:<12}{s['p50_ms']:>7.1f}ms{s['p95_ms']:>7.1f}ms{s['p99_ms']:>7.1f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(args), 'results': results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
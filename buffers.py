@@ -0,0 +1,179 @@
+"""
+Frame Buffers
+Each stream reuses a small set of preallocated frame arrays (resize targets,
+output frames) instead of allocating new ones for every frame. At 30 fps on
+many cameras that removes a lot of allocator and GC churn.
+
+SharedFrameRing allocates those frames once, in one shared memory block, so
+the pipeline stages - threads or worker processes - pass slot numbers around
+instead of arrays.
+"""
+
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+class SharedFrameRing:
+    """Fixed set of preallocated frame slots in shared memory.
+
+    A writer acquire()s a free slot, fills ring.frame(slot) and publish()es
+    it, which stamps the slot with a new sequence number. Queues carry
+    (slot, seq) pairs. The reading stage take()s the pair - which fails if the
+    slot was overwritten in the meantime - and release()s the slot when done.
+    When no slot is free, the oldest published but not yet taken frame is
+    overwritten, so capture never waits for a slow stage.
+
+    Counters per consuming stage:
+        consumed    - frames the stage took
+        dropped     - frames thrown away by the stage's queue
+        overwritten - frames reused for a newer one before the stage got them
+    """
+
+    FREE, WRITING, PUBLISHED, TAKEN = range(4)
+
+    def __init__(self, shape, slots=8, dtype=np.uint8, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None  # The creator unlinks the block
+
+        header = 8 * slots  # One int64 sequence number per slot
+        size = header + slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.nbytes = size
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.seqs = np.ndarray((slots,), np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, self.dtype,
+                                 buffer=self.shm.buf, offset=header)
+
+        self.state = [self.FREE] * slots
+        self.stage_of = [None] * slots  # Stage each published slot is waiting for
+        self.free = list(range(slots))
+        self.next_seq = 0
+        self.lock = threading.Lock()
+        self.counters = {}
+        if self.owner:
+            self.seqs[:] = -1
+
+    @classmethod
+    def attach(cls, name, shape, slots, dtype=np.uint8):
+        """Open a ring created by another process (frames only, no bookkeeping)"""
+        return cls(shape, slots, dtype, name=name)
+
+    def frame(self, slot, shape=None):
+        """The frame array of one slot (a view, not a copy).
+        A smaller shape uses the start of the slot, for streams whose
+        resolution changes while they run."""
+        if shape is None or tuple(shape) == self.shape:
+            return self.frames[slot]
+        return self.frames[slot].reshape(-1)[:int(np.prod(shape))].reshape(shape)
+
+    def _count(self, stage, counter):
+        stats = self.counters.setdefault(stage, {'consumed': 0, 'dropped': 0, 'overwritten': 0})
+        stats[counter] += 1
+
+    def acquire(self):
+        """A slot to write a new frame into"""
+        with self.lock:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                # Overwrite the oldest frame nobody has taken yet
+                waiting = [s for s in range(self.slots) if self.state[s] == self.PUBLISHED]
+                if not waiting:
+                    raise RuntimeError("All frame slots are in use - make the ring bigger")
+                slot = min(waiting, key=lambda s: self.seqs[s])
+                self._count(self.stage_of[slot], 'overwritten')
+                self.seqs[slot] = -1  # Readers holding the old seq will see it's gone
+            self.state[slot] = self.WRITING
+            return slot
+
+    def publish(self, slot, stage):
+        """Mark a written slot as ready for stage. Returns (slot, seq)"""
+        with self.lock:
+            self.next_seq += 1
+            self.seqs[slot] = self.next_seq
+            self.state[slot] = self.PUBLISHED
+            self.stage_of[slot] = stage
+            return slot, self.next_seq
+
+    def take(self, item):
+        """Claim a published (slot, seq). False if it was overwritten"""
+        slot, seq = item
+        with self.lock:
+            if self.seqs[slot] != seq or self.state[slot] != self.PUBLISHED:
+                return False
+            self.state[slot] = self.TAKEN
+            self._count(self.stage_of[slot], 'consumed')
+            return True
+
+    def drop(self, item):
+        """A queue threw a published (slot, seq) away - free the slot"""
+        slot, seq = item
+        with self.lock:
+            if self.seqs[slot] != seq or self.state[slot] != self.PUBLISHED:
+                return  # Already overwritten
+            self._count(self.stage_of[slot], 'dropped')
+            self._free(slot)
+
+    def release(self, slot):
+        """Give a slot back once its frame is done with"""
+        with self.lock:
+            self._free(slot)
+
+    def _free(self, slot):
+        self.state[slot] = self.FREE
+        self.stage_of[slot] = None
+        self.free.append(slot)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'slots': self.slots,
+                'bytes': self.nbytes,  # Allocated once, when the stream starts
+                'in_use': self.slots - len(self.free),
+                'frames': self.next_seq,
+                'stages': {stage: dict(c) for stage, c in self.counters.items()},
+            }
+
+    def close(self):
+        """Unmap the block (and delete it, in the process that created it).
+        numpy views don't stop the unmap, so no thread may still use a frame."""
+        if self.frames is None:
+            return
+        self.seqs = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Something still exports the buffer; the mapping goes when it does
+        if self.owner:
+            self.shm.unlink()
+
+
+def copy_into(frame, output=None):
+    """frame.copy(), but into a reused output buffer when one is given"""
+    if output is None:
+        return frame.copy()
+    np.copyto(output, frame)
+    return output
+
+
+def rss_bytes():
+    """Current resident memory of this process (peak RSS if /proc is missing)"""
+    if resource is None:
+        return 0
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,165 @@
+"""
+Camera Manager
+Keeps a registry of cameras keyed by camera ID, so one process can serve many
+cameras. Each camera owns its own capture lifecycle: the first viewer starts
+its pipeline and the last viewer out stops it. All cameras share the models
+through the pipeline factory the app passes in. With make_settings every
+camera also keeps live settings, which outlive its pipeline restarts.
+"""
+
+import asyncio
+import threading
+import uuid
+
+
+class Camera:
+    """One registered camera and its shared pipeline"""
+
+    def __init__(self, camera_id, url, make_pipeline, settings=None):
+        self.id = camera_id
+        self.url = url
+        self.make_pipeline = make_pipeline
+        self.settings = settings
+        self.pipeline = None
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Get the running pipeline for this camera, starting it if needed"""
+        with self.lock:
+            if self.pipeline and self.pipeline.attach():
+                return self.pipeline
+
+            if self.settings is None:
+                pipeline = self.make_pipeline(self.url)
+            else:
+                pipeline = self.make_pipeline(self.url, self.settings)
+            if not pipeline.start():
+                print(f"Error: Cannot open camera URL: {self.url}")
+                pipeline.stop()  # Frees the processor's state
+                return None
+
+            print(f"Connected to camera {self.id}: {self.url}")
+            pipeline.attach()
+            self.pipeline = pipeline
+            return pipeline
+
+    def release(self, pipeline):
+        """Drop one viewer - the last viewer out stops the camera"""
+        with self.lock:
+            if pipeline.detach() > 0:
+                return
+            pipeline.stop()
+            if self.pipeline is pipeline:
+                self.pipeline = None
+        print(f"Camera {self.id} released")
+
+    def stop(self):
+        """Stop the pipeline so every viewer's stream ends"""
+        with self.lock:
+            if self.pipeline:
+                self.pipeline.stop()
+                self.pipeline = None
+
+    def stream(self):
+        """Yield multipart JPEG chunks for one viewer"""
+        pipeline = self.acquire()
+        if pipeline is None:
+            return
+
+        try:
+            yield from pipeline.subscribe()
+        finally:
+            self.release(pipeline)
+
+    async def stream_async(self):
+        """Async version of stream() for the ASGI server.
+        Starting and stopping the camera can block, so they run on a thread."""
+        loop = asyncio.get_running_loop()
+        pipeline = await loop.run_in_executor(None, self.acquire)
+        if pipeline is None:
+            return
+
+        try:
+            async for part in pipeline.subscribe_async():
+                yield part
+        finally:
+            await loop.run_in_executor(None, self.release, pipeline)
+
+    def info(self):
+        pipeline = self.pipeline
+        return {
+            'camera_id': self.id,
+            'url': self.url,
+            'running': bool(pipeline and pipeline.running),
+            'connected': bool(pipeline and pipeline.connected),
+            'reconnects': pipeline.reconnects if pipeline else 0,
+            'viewers': pipeline.subscribers if pipeline else 0,
+            'buffers': pipeline.ring.stats() if pipeline else None,
+            'change_detector': (pipeline.change_detector.stats()
+                                if pipeline and pipeline.change_detector else None),
+            'settings': self.settings.snapshot() if self.settings else None,
+        }
+
+
+class CameraManager:
+    """Registry of cameras keyed by camera ID"""
+
+    def __init__(self, make_pipeline, make_settings=None):
+        self.make_pipeline = make_pipeline
+        self.make_settings = make_settings  # make_pipeline(url, settings) gets them
+        self.cameras = {}
+        self.last_camera_id = None
+        self.lock = threading.Lock()
+
+    def add(self, url):
+        """Register a camera URL and return its Camera. Re-adding a URL reuses it"""
+        with self.lock:
+            for camera in self.cameras.values():
+                if camera.url == url:
+                    self.last_camera_id = camera.id
+                    return camera
+
+            camera_id = uuid.uuid4().hex[:8]
+            settings = self.make_settings() if self.make_settings else None
+            camera = Camera(camera_id, url, self.make_pipeline, settings)
+            self.cameras[camera_id] = camera
+            self.last_camera_id = camera_id
+            return camera
+
+    def get(self, camera_id):
+        return self.cameras.get(camera_id)
+
+    def latest(self):
+        """The most recently added camera (for the old single-camera routes)"""
+        return self.cameras.get(self.last_camera_id)
+
+    def remove(self, camera_id):
+        """Stop and forget one camera. Returns False if the ID is unknown"""
+        with self.lock:
+            camera = self.cameras.pop(camera_id, None)
+            if self.last_camera_id == camera_id:
+                self.last_camera_id = None
+        if camera is None:
+            return False
+        camera.stop()
+        return True
+
+    def remove_all(self):
+        with self.lock:
+            cameras = list(self.cameras.values())
+            self.cameras.clear()
+            self.last_camera_id = None
+        for camera in cameras:
+            camera.stop()
+
+    def list(self):
+        return [camera.info() for camera in list(self.cameras.values())]
+
+    def stats(self):
+        """{camera_id: pipeline.stats()} for every running camera"""
+        stats = {}
+        for camera in list(self.cameras.values()):
+            pipeline = camera.pipeline
+            if pipeline is not None:
+                stats[camera.id] = pipeline.stats()
+        return stats
@@ -0,0 +1,121 @@
+"""
+Camera Connections
+Opening an RTSP/HTTP camera can hang for a long time when the camera is down,
+so captures are opened on a worker thread with a timeout. The handle opened
+to test a camera URL is kept in a small pool, so the stream that starts right
+after reuses it instead of doing a second handshake.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import cv2
+
+
+# Network streams that the FFmpeg backend opens (and that can hang)
+NETWORK_SCHEMES = ('rtsp://', 'rtsps://', 'rtmp://', 'http://', 'https://', 'udp://', 'tcp://')
+
+
+def has_ffmpeg():
+    """True if this OpenCV build has the FFmpeg video backend"""
+    registry = getattr(cv2, 'videoio_registry', None)
+    if registry is None or not hasattr(cv2, 'CAP_FFMPEG'):
+        return False
+    return registry.hasBackend(cv2.CAP_FFMPEG)
+
+
+def open_capture(url, timeout=5.0):
+    """Open a cv2.VideoCapture, telling the backend about the timeout when it can.
+    Returns None if the camera can't be opened."""
+    source = int(url) if str(url).isdigit() else url  # "0" means the webcam
+    # Newer OpenCV builds accept open / read timeouts, but only the FFmpeg
+    # backend knows them - any other backend refuses to open with them
+    if (isinstance(source, str) and source.lower().startswith(NETWORK_SCHEMES)
+            and hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC') and has_ffmpeg()):
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000),
+                  cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(timeout * 1000)]
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+    else:
+        cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        cap.release()
+        return None
+    return cap
+
+
+def _release_late(future):
+    """Close a connection that opened after its caller gave up on it"""
+    if not future.exception() and future.result() is not None:
+        future.result().release()
+
+
+class CapturePool:
+    """Opens cameras off the request thread and keeps probed handles for reuse"""
+
+    def __init__(self, open_timeout=5.0, max_idle=10.0, workers=4):
+        self.open_timeout = open_timeout  # Longest a probe waits for the camera
+        self.max_idle = max_idle          # Unused handles are closed after this
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='probe')
+        self.idle = {}  # url -> (cap, time it was pooled)
+        self.lock = threading.Lock()
+
+    def open(self, url, timeout=None):
+        """Open a camera, giving up after timeout seconds.
+        A connection that finishes after the timeout is closed in the background."""
+        timeout = self.open_timeout if timeout is None else timeout
+        future = self.executor.submit(open_capture, url, timeout)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.add_done_callback(_release_late)
+            return None
+
+    def probe(self, url, timeout=None):
+        """Check that a camera answers. The open handle is pooled for the stream"""
+        cap = self.take(url) or self.open(url, timeout)
+        if cap is None:
+            return False
+        self.put(url, cap)
+        return True
+
+    def put(self, url, cap):
+        """Keep an open handle for a while in case a stream wants it"""
+        with self.lock:
+            old = self.idle.pop(url, None)
+            self.idle[url] = (cap, time.monotonic())
+        if old:
+            old[0].release()
+        timer = threading.Timer(self.max_idle, self._expire, (url, cap))
+        timer.daemon = True
+        timer.start()
+
+    def take(self, url):
+        """The pooled handle for this URL, or None"""
+        with self.lock:
+            entry = self.idle.pop(url, None)
+        return entry[0] if entry else None
+
+    def connect(self, url, timeout=None):
+        """A pooled handle if there is one, otherwise a fresh connection"""
+        return self.take(url) or self.open(url, timeout)
+
+    def _expire(self, url, cap):
+        with self.lock:
+            entry = self.idle.get(url)
+            if entry is None or entry[0] is not cap:
+                return
+            del self.idle[url]
+        cap.release()
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    """The process-wide capture pool (created on first use)"""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = CapturePool()
+        return _default_pool
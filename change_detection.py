@@ -0,0 +1,57 @@
+"""
+Change Detection
+Surveillance feeds are static most of the time. The ChangeDetector compares a
+tiny grayscale thumbnail of each frame with the last frame that was fully
+processed. If nothing moved, the pipeline skips both YOLO models, the blur
+and the JPEG encode, and re-sends the previous JPEG bytes instead.
+"""
+
+import threading
+import cv2
+import numpy as np
+
+
+class ChangeDetector:
+    """Cheap downsampled frame-diff in front of the AI"""
+
+    def __init__(self, pixel_threshold=20, changed_fraction=0.002,
+                 thumb_size=(80, 60), max_skip=30):
+        self.pixel_threshold = pixel_threshold      # Gray levels a pixel must change by
+        self.changed_fraction = changed_fraction    # Share of thumbnail pixels that must change
+        self.thumb_size = thumb_size
+        self.max_skip = max_skip                    # Reprocess at least this often anyway
+        self.reference = None
+        self.skipped_in_row = 0
+        self.lock = threading.Lock()
+
+        self.frames = 0
+        self.reused = 0
+
+    def changed(self, frame):
+        """True if the frame differs enough from the last processed one.
+        When it returns True the frame becomes the new reference."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        thumb = cv2.resize(gray, self.thumb_size, interpolation=cv2.INTER_AREA)
+
+        with self.lock:
+            self.frames += 1
+            if self.reference is not None and self.skipped_in_row < self.max_skip:
+                diff = cv2.absdiff(thumb, self.reference)
+                moved = np.count_nonzero(diff > self.pixel_threshold)
+                if moved < self.changed_fraction * diff.size:
+                    self.skipped_in_row += 1
+                    self.reused += 1
+                    return False
+
+            # Compare against the last processed frame, so slow drift adds up
+            self.reference = thumb
+            self.skipped_in_row = 0
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'frames': self.frames,
+                'reused': self.reused,
+                'saved_ratio': self.reused / self.frames if self.frames else 0.0,
+            }
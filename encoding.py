@@ -0,0 +1,155 @@
+"""
+JPEG Encoding
+Pluggable JPEG encoder backends, a shared encode worker pool, and per-viewer
+adaptive quality.
+
+Backends (picked with ENCODER or "auto"):
+    turbojpeg - libjpeg-turbo through PyTurboJPEG (pip install PyTurboJPEG)
+    pil       - Pillow, or Pillow-SIMD when it is installed
+    opencv    - cv2.imencode, always available
+
+Viewers that drain the stream slowly are moved to a smaller / lower quality
+tier, so they get lighter frames instead of a growing backlog.
+"""
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+
+class OpenCVEncoder:
+    name = 'opencv'
+
+    def encode(self, image, quality):
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return memoryview(buffer) if ok else None
+
+
+class TurboJPEGEncoder:
+    name = 'turbojpeg'
+
+    def __init__(self):
+        from turbojpeg import TurboJPEG, TJPF_BGR
+        self.jpeg = TurboJPEG()
+        self.pixel_format = TJPF_BGR
+
+    def encode(self, image, quality):
+        return self.jpeg.encode(image, quality=quality, pixel_format=self.pixel_format)
+
+
+class PILEncoder:
+    name = 'pil'
+
+    def __init__(self):
+        from PIL import Image
+        self.Image = Image
+
+    def encode(self, image, quality):
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        out = io.BytesIO()
+        self.Image.fromarray(rgb).save(out, format='JPEG', quality=quality)
+        return out.getbuffer()
+
+
+ENCODERS = {
+    'opencv': OpenCVEncoder,
+    'turbojpeg': TurboJPEGEncoder,
+    'pil': PILEncoder,
+}
+
+
+def make_encoder(name='auto'):
+    """Build an encoder backend. "auto" picks the fastest one installed"""
+    if name != 'auto':
+        return ENCODERS[name]()
+
+    try:
+        return TurboJPEGEncoder()
+    except Exception:  # Python binding or the libjpeg-turbo library missing
+        pass
+    try:
+        import PIL
+        if '.post' in PIL.__version__:  # Pillow-SIMD versions look like 9.0.0.post1
+            return PILEncoder()
+    except ImportError:
+        pass
+    return OpenCVEncoder()
+
+
+class EncoderPool:
+    """Encodes frames on a worker pool shared by every camera"""
+
+    def __init__(self, encoder='auto', workers=None):
+        self.encoder = make_encoder(encoder) if isinstance(encoder, str) else encoder
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 2,
+                                           thread_name_prefix='jpeg')
+
+    def encode(self, image, quality, scale=1.0):
+        """Encode on the pool and wait. Returns JPEG bytes (or a buffer of them)"""
+        return self.executor.submit(self._encode, image, quality, scale).result()
+
+    def _encode(self, image, quality, scale):
+        if scale != 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return self.encoder.encode(image, quality)
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def default_pool(encoder='auto'):
+    """The process-wide encoder pool (created on first use)"""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = EncoderPool(encoder)
+            print(f"JPEG encoder: {_default_pool.encoder.name}")
+        return _default_pool
+
+
+def quality_tiers(quality):
+    """(scale, quality) per tier - tier 0 is the full stream"""
+    return [
+        (1.0, quality),
+        (1.0, max(quality - 20, 30)),
+        (0.75, max(quality - 25, 30)),
+        (0.5, max(quality - 35, 25)),
+    ]
+
+
+class AdaptiveQuality:
+    """Picks a quality tier for one viewer from how fast it drains the stream.
+    If sending a frame takes most of the time between frames the viewer is
+    falling behind, so it moves down a tier. Once it has plenty of headroom
+    for a while it moves back up."""
+
+    def __init__(self, tier_count, slow=0.8, fast=0.3, upgrade_after=30):
+        self.tier_count = tier_count
+        self.slow = slow
+        self.fast = fast
+        self.upgrade_after = upgrade_after
+        self.tier = 0
+        self.load = 0.0
+        self.fast_frames = 0
+
+    def update(self, send_seconds, frame_interval):
+        """Record how long one frame took to send. Returns the tier to use next"""
+        if frame_interval <= 0:
+            return self.tier
+        self.load = 0.8 * self.load + 0.2 * (send_seconds / frame_interval)
+
+        if self.load > self.slow and self.tier < self.tier_count - 1:
+            self.tier += 1
+            self.load = 0.0
+            self.fast_frames = 0
+        elif self.load < self.fast and self.tier > 0:
+            self.fast_frames += 1
+            if self.fast_frames >= self.upgrade_after:
+                self.tier -= 1
+                self.fast_frames = 0
+        else:
+            self.fast_frames = 0
+        return self.tier
@@ -0,0 +1,142 @@
+"""
+Quality Governor
+Holds each stream at a target fps and latency budget by changing its quality
+at runtime. When frames come out too slowly or too late it steps down a
+ladder of (resolution, detection interval) pairs; when there is headroom for
+a while it steps back up. The privacy floor - lowest resolution and longest
+detection interval - is never crossed, whatever the load.
+
+The governor works on the stream's live settings (see settings.py):
+    governor          - on / off
+    target_fps        - wanted frames per second (capped at the rate the pipeline
+                        offers frames: the camera's, over its frame skipping)
+    latency_budget_ms - longest capture-to-viewer time for most frames (p90)
+    min_resolution    - privacy floor: never a smaller frame width
+    max_detect_every  - privacy floor: never fewer full detections
+and changes 'resolution' and 'detect_every'. All of them can be changed live.
+"""
+
+import collections
+import time
+
+# From best quality to cheapest: (frame width, run detection every N frames).
+# Each step costs less than the one before (width^2 / N).
+LADDER = (
+    (640, 1), (640, 2), (544, 2), (480, 2), (480, 3),
+    (416, 3), (352, 3), (320, 4), (256, 4), (256, 6),
+)
+
+
+def cost(resolution, detect_every):
+    """Rough cost of a level: pixels per frame over how often detection runs"""
+    return resolution * resolution / detect_every
+
+
+def enforce_floor(settings):
+    """Lift the resolution and detection interval back to the privacy floor
+    (after the floor itself was changed)"""
+    values = settings.snapshot()
+    resolution = max(values['resolution'], values['min_resolution'])
+    detect_every = min(values['detect_every'], values['max_detect_every'])
+    if (resolution, detect_every) != (values['resolution'], values['detect_every']):
+        settings.update(resolution=resolution, detect_every=detect_every)
+
+
+class QualityGovernor:
+    """Moves one stream up and down the quality LADDER"""
+
+    def __init__(self, settings, tune_interval=True, interval=2.0, upgrade_after=3,
+                 ladder=LADDER):
+        self.settings = settings
+        self.tune_interval = tune_interval  # False = only the resolution changes
+        self.interval = interval            # Seconds between decisions
+        self.upgrade_after = upgrade_after  # Decisions with headroom in a row before stepping up
+        self.ladder = ladder
+        self.latencies = collections.deque(maxlen=1000)
+        self.last_check = time.monotonic()
+        self.good_checks = 0
+        self.changes = 0
+        self.status = {'state': 'starting'}
+
+    def levels(self, values):
+        """Ladder steps above the privacy floor and within the resolution limit"""
+        highest = self.settings.limits['resolution'][2]
+        levels = []
+        for resolution, every in self.ladder:
+            if not self.tune_interval:
+                every = values['detect_every']
+            if not values['min_resolution'] <= resolution <= highest:
+                continue
+            if every > values['max_detect_every']:
+                continue
+            if (resolution, every) not in levels:
+                levels.append((resolution, every))
+        return levels
+
+    def frame_done(self, latency, stream):
+        """Called by the pipeline for every published frame.
+        stream is the pipeline's StreamMetrics, for the frame rates."""
+        self.latencies.append(latency)
+        now = time.monotonic()
+        if now - self.last_check >= self.interval:
+            self.last_check = now
+            self.check(stream)
+            self.latencies.clear()  # The next window only sees the new settings
+
+    def check(self, stream):
+        """Compare the last window with the goals and step if needed"""
+        values = self.settings.snapshot()
+        if not values['governor']:
+            self.good_checks = 0
+            self.status = {'state': 'off'}
+            return
+        levels = self.levels(values)
+        if not levels:
+            self.status = {'state': 'no level fits the privacy floor'}
+            return
+
+        fps = stream.rates['published'].rate()
+        camera_fps = stream.rates['captured'].rate()
+        offered_fps = stream.rates['offered'].rate()  # Captured frames left after skipping
+        goal = min(values['target_fps'], 0.95 * offered_fps)  # Can't beat the camera
+        latencies = sorted(self.latencies)
+        latency_ms = 1000 * latencies[int(0.9 * (len(latencies) - 1))] if latencies else 0.0
+        budget = values['latency_budget_ms']
+
+        # Start from the level closest to the current settings (they may have been set by hand)
+        current_cost = cost(values['resolution'], values['detect_every'])
+        level = min(range(len(levels)), key=lambda i: abs(cost(*levels[i]) - current_cost))
+
+        state = 'holding'
+        if fps < 0.9 * goal or latency_ms > budget:
+            self.good_checks = 0
+            if level < len(levels) - 1:
+                level += 1
+                state = 'stepping down'
+            else:
+                state = 'at privacy floor'
+        elif fps >= 0.97 * goal and latency_ms < 0.7 * budget and level > 0:
+            self.good_checks += 1
+            if self.good_checks >= self.upgrade_after:
+                self.good_checks = 0
+                level -= 1
+                state = 'stepping up'
+        else:
+            self.good_checks = 0
+
+        resolution, every = levels[level]
+        if (resolution, every) != (values['resolution'], values['detect_every']):
+            self.settings.update(resolution=resolution, detect_every=every)
+            self.changes += 1
+
+        self.status = {
+            'state': state,
+            'fps': fps,
+            'camera_fps': camera_fps,
+            'offered_fps': offered_fps,
+            'goal_fps': goal,
+            'latency_p90_ms': latency_ms,
+            'level': level,
+            'levels': len(levels),
+            'changes': self.changes,
+        }
@@ -0,0 +1,161 @@
+"""
+Batched Inference
+Every camera's pipeline asks for detections one frame at a time. The
+BatchScheduler collects those requests from all active streams and runs them
+through the model as one batch, then hands each result back to the stream
+that asked for it. More cameras = bigger batches = better use of the hardware.
+
+There are also helpers for a cascaded mode, where the ID card model only looks
+at crops around detected faces instead of the whole frame.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class BatchRequest:
+    """One frame waiting to be run through the model"""
+
+    def __init__(self, frame, predict_args, postprocess_args=None):
+        self.frame = frame
+        self.predict_args = predict_args
+        self.postprocess_args = postprocess_args or {}  # This request's own, not batched on
+        self.key = tuple(sorted(predict_args.items()))
+        self.future = Future()
+
+
+class BatchScheduler:
+    """Runs frames from every stream through one model in batches"""
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10, postprocess=None,
+                 model_loader=None):
+        self.model = model
+        self.model_loader = model_loader  # Gets the model on first use if model is None
+        self.postprocess = postprocess  # Runs on each Results in the worker thread, with
+                                        # the postprocess_args given to submit()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.pending = collections.deque()
+        self.cond = threading.Condition()
+
+        # Simple counters to check how well batching works
+        self.batches = 0
+        self.frames = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, postprocess_args=None, **predict_args):
+        """Queue a frame and return a Future with its Results"""
+        request = BatchRequest(frame, predict_args, postprocess_args)
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify()
+        return request.future
+
+    def predict(self, frame, postprocess_args=None, **predict_args):
+        """Blocking version of submit() - returns the Results for one frame"""
+        return self.submit(frame, postprocess_args, **predict_args).result()
+
+    @property
+    def average_batch_size(self):
+        return self.frames / self.batches if self.batches else 0.0
+
+    def _next_batch(self):
+        """Wait for the batch to fill up or for the deadline, whichever is first.
+        Only requests with the same predict arguments (conf, imgsz...) are
+        batched together; the rest wait for the next round."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.pending)
+            key = self.pending[0].key
+            deadline = time.monotonic() + self.max_wait
+
+            while True:
+                matching = sum(1 for r in self.pending if r.key == key)
+                remaining = deadline - time.monotonic()
+                if matching >= self.max_batch_size or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+            batch, rest = [], collections.deque()
+            for request in self.pending:
+                if request.key == key and len(batch) < self.max_batch_size:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self.pending = rest
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            frames = [request.frame for request in batch]
+
+            try:
+                if self.model is None:
+                    self.model = self.model_loader()  # Waits for a lazy load
+                results = self.model.predict(source=frames, verbose=False,
+                                             **batch[0].predict_args)
+                if self.postprocess:
+                    results = [self.postprocess(result, **request.postprocess_args)
+                               for request, result in zip(batch, results)]
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.frames += len(batch)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+
+def result_boxes(result, min_area=0, max_area=None):
+    """Boxes of one Results as (x1, y1, x2, y2) int tuples.
+    Unrealistic sizes are dropped in one vectorized step on the whole tensor,
+    before any per-box Python work."""
+    xyxy = result.boxes.xyxy
+    if hasattr(xyxy, 'cpu'):
+        xyxy = xyxy.cpu().numpy()
+    xyxy = np.asarray(xyxy).reshape(-1, 4).astype(np.int64)
+
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    keep = areas >= min_area
+    if max_area is not None:
+        keep &= areas <= max_area
+    return [tuple(box) for box in xyxy[keep].tolist()]
+
+
+def upper_body_regions(face_boxes, shape, widen=3.0, below=4.0):
+    """Area around and under each face where a person's ID card can be"""
+    height, width = shape[:2]
+    regions = []
+    for (x1, y1, x2, y2) in face_boxes:
+        w, h = x2 - x1, y2 - y1
+        cx = (x1 + x2) / 2
+        rx1 = int(max(cx - w * widen / 2, 0))
+        rx2 = int(min(cx + w * widen / 2, width))
+        ry1 = int(max(y1 - h / 2, 0))
+        ry2 = int(min(y2 + h * below, height))
+        if rx2 > rx1 and ry2 > ry1:
+            regions.append((rx1, ry1, rx2, ry2))
+    return regions
+
+
+def detect_in_regions(scheduler, frame, regions, **predict_args):
+    """Run a detector only on crops of the frame, all in one batch.
+    Boxes are mapped back to frame coordinates."""
+    requests = []
+    for (x1, y1, x2, y2) in regions:
+        crop = np.ascontiguousarray(frame[y1:y2, x1:x2])
+        requests.append(((x1, y1), scheduler.submit(crop, **predict_args)))
+
+    boxes = []
+    for (ox, oy), future in requests:
+        for (x1, y1, x2, y2) in future.result():
+            boxes.append((x1 + ox, y1 + oy, x2 + ox, y2 + oy))
+    return boxes
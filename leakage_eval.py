@@ -0,0 +1,198 @@
+"""
+Redaction Leakage Evaluation
+Speed settings (low confidence, small model input, frame skipping, tracking
+between detections) can let faces or ID cards through unblurred. This script
+replays a labeled clip through each benchmark configuration and measures how
+many ground-truth face / ID card pixels were left unredacted on every frame a
+viewer would see, next to the fps:
+
+    python leakage_eval.py --video clip.mp4 --labels clip_labels.json --budget 0.01
+
+A skipped frame is never shown - the viewer keeps seeing the last redacted
+frame - so it counts with the leakage of that frame.
+
+Labels file (boxes are x1, y1, x2, y2 in pixels of the original video):
+    {"frames": {"0": {"faces": [[x1, y1, x2, y2], ...], "id_cards": [...]},
+                "1": {...}}}
+Frames that are not in the file are not scored. A face can be written as
+{"box": [...], "speaker": true} to mark the person the app leaves visible on
+purpose; it is only ignored with --keep-speaker.
+
+This measures coverage: a pixel counts as redacted when a blur covers it,
+whatever the blur strength.
+"""
+
+import argparse
+import json
+import sys
+import cv2
+import numpy as np
+
+import balanced_camera_app as app
+from benchmark import CONFIGS, FrameSource, build_configs, run_config
+from encoding import make_encoder
+from redaction import box_mask
+
+CLASSES = ('faces', 'id_cards')
+
+
+def load_labels(path):
+    """{frame index: {'faces': [...], 'id_cards': [...], 'speakers': [...]}}"""
+    with open(path) as f:
+        data = json.load(f)
+    labels = {}
+    for index, objects in data['frames'].items():
+        frame = {'faces': [], 'id_cards': [], 'speakers': []}
+        for face in objects.get('faces', []):
+            if isinstance(face, dict):
+                frame['speakers' if face.get('speaker') else 'faces'].append(face['box'])
+            else:
+                frame['faces'].append(face)
+        frame['id_cards'] = list(objects.get('id_cards', []))
+        labels[int(index)] = frame
+    return labels
+
+
+def visible_fractions(shape, boxes, redacted, scale):
+    """For each ground-truth box: (pixels, pixels left unredacted) in the output frame"""
+    height, width = shape[:2]
+    sx, sy = scale
+    result = []
+    for x1, y1, x2, y2 in boxes:
+        x1, x2 = int(max(x1 * sx, 0)), int(min(x2 * sx, width))
+        y1, y2 = int(max(y1 * sy, 0)), int(min(y2 * sy, height))
+        if x2 <= x1 or y2 <= y1:
+            continue
+        region = redacted[y1:y2, x1:x2]
+        result.append((region.size, int(region.size - np.count_nonzero(region))))
+    return result
+
+
+class LeakageScorer:
+    """Scores every shown frame against the labels (the on_output hook of run_config)"""
+
+    def __init__(self, labels, source_size, keep_speaker, object_threshold=0.2):
+        self.labels = labels
+        self.source_size = source_size  # (width, height) of the labeled video
+        self.keep_speaker = keep_speaker
+        self.object_threshold = object_threshold  # Object counts as leaked above this
+        self.shown = set()  # Indexes of the frames that were shown
+        self.scores = {}  # frame index -> {class: [(pixels, leaked), ...]}
+
+    def __call__(self, index, output, face_boxes, id_boxes):
+        self.shown.add(index)
+        objects = self.labels.get(index)
+        if objects is None:
+            return
+        # Any redaction hides what is under it, a face under an ID card blur too
+        redacted = box_mask(output.shape, list(face_boxes) + list(id_boxes))
+        scale = (output.shape[1] / self.source_size[0], output.shape[0] / self.source_size[1])
+        faces = objects['faces'] if self.keep_speaker else objects['faces'] + objects['speakers']
+        self.scores[index] = {
+            'faces': visible_fractions(output.shape, faces, redacted, scale),
+            'id_cards': visible_fractions(output.shape, objects['id_cards'], redacted, scale),
+        }
+
+    def summary(self, frames_read):
+        """Leakage over every frame a viewer saw, skipped frames included"""
+        totals = {name: [0, 0] for name in CLASSES}
+        objects = {name: [0, 0] for name in CLASSES}  # [seen, leaked]
+        worst = 0.0
+        frames = frames_leaking = 0
+        shown = None  # Scores of the frame on screen
+        for index in range(frames_read):
+            if index in self.shown:
+                shown = self.scores.get(index)  # None if that frame has no labels
+            if index not in self.labels or shown is None:
+                continue
+            # A skipped frame shows the last redacted frame, scored against that frame's labels
+            frames += 1
+            frame_pixels = frame_leaked = 0
+            leaking = False
+            for name in CLASSES:
+                for pixels, leaked in shown[name]:
+                    totals[name][0] += pixels
+                    totals[name][1] += leaked
+                    frame_pixels += pixels
+                    frame_leaked += leaked
+                    objects[name][0] += 1
+                    if leaked > self.object_threshold * pixels:
+                        objects[name][1] += 1
+                        leaking = True
+            frames_leaking += leaking
+            if frame_pixels:
+                worst = max(worst, frame_leaked / frame_pixels)
+
+        result = {'frames_scored': frames, 'frames_leaking': frames_leaking,
+                  'worst_frame_leakage': worst}
+        all_pixels = all_leaked = 0
+        for name in CLASSES:
+            pixels, leaked = totals[name]
+            all_pixels += pixels
+            all_leaked += leaked
+            result[name] = {
+                'pixel_leakage': leaked / pixels if pixels else 0.0,
+                'objects': objects[name][0],
+                'objects_leaked': objects[name][1],
+            }
+        result['pixel_leakage'] = all_leaked / all_pixels if all_pixels else 0.0
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure unredacted face / ID card pixels per configuration")
+    parser.add_argument('--video', required=True, help="labeled video clip")
+    parser.add_argument('--labels', required=True, help="JSON ground truth boxes per frame")
+    parser.add_argument('--frames', type=int, default=10 ** 9, help="stop after this many frames")
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS),
+                        help=f"presets to run ({', '.join(CONFIGS)})")
+    parser.add_argument('--config-file', help="JSON file of {name: {setting: value}} to run too")
+    parser.add_argument('--encoder', default='opencv', help="JPEG encoder (see encoding.py)")
+    parser.add_argument('--keep-speaker', action='store_true',
+                        help="leave the speaker visible like the app (label them with \"speaker\": true)")
+    parser.add_argument('--budget', type=float, default=0.01,
+                        help="highest acceptable fraction of leaked pixels")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    overrides = None
+    if args.config_file:
+        with open(args.config_file) as f:
+            overrides = json.load(f)
+    configs = build_configs(args.configs, overrides)
+
+    app.models.get()  # Load and warm up before any timing starts
+    encoder = make_encoder(args.encoder)
+    results = {}
+    for name, config in configs.items():
+        config['keep_speaker'] = args.keep_speaker
+        source = FrameSource(args.video)
+        size = (int(source.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(source.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        scorer = LeakageScorer(labels, size, args.keep_speaker)
+        speed = run_config(config, source, args.frames, encoder, on_output=scorer)
+        source.close()
+        results[name] = dict(scorer.summary(speed['frames_read']),
+                             config=config, output_fps=speed['output_fps'],
+                             frame_p95_ms=speed['stages'].get('frame', {}).get('p95_ms', 0.0))
+
+    print(f"{'config':<20}{'fps':>8}{'leaked px':>11}{'faces':>9}{'id cards':>10}"
+          f"{'worst frame':>13}{'leaky frames':>14}")
+    for name, r in results.items():
+        print(f"{name:<20}{r['output_fps']:>8.1f}{r['pixel_leakage']:>10.2%}"
+              f"{r['faces']['pixel_leakage']:>9.2%}{r['id_cards']['pixel_leakage']:>10.2%}"
+              f"{r['worst_frame_leakage']:>13.2%}{r['frames_leaking']:>8}/{r['frames_scored']}")
+
+    within = [name for name, r in results.items() if r['pixel_leakage'] <= args.budget]
+    if within:
+        best = max(within, key=lambda name: results[name]['output_fps'])
+        print(f"\nFastest configuration within {args.budget:.2%} leakage: {best}")
+    else:
+        print(f"\nNo configuration stays within {args.budget:.2%} leakage")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'budget': args.budget, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    sys.exit(0 if within else 1)
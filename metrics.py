@@ -0,0 +1,198 @@
+"""
+Metrics
+Per-stream timing histograms, frame rates and counters, so we can see which
+stage is the bottleneck: capture, face / ID card detection, blurring or
+JPEG encoding. Served as JSON on /stats and in Prometheus text format on
+/metrics.
+
+Recording is cheap: a histogram observation is one bisect and two additions,
+and each histogram is only written by the stage thread that owns it.
+Code inside a processor records through record() / count(), which go to the
+metrics of the stream whose thread is running it (see bind()).
+"""
+
+import bisect
+import collections
+import threading
+import time
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram:
+    """Counts of observations per latency bucket"""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.sum += ms
+        self.count += 1
+
+    def percentile(self, q):
+        """Approximate percentile (0-100): upper bound of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        target = self.count * q / 100.0
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return float(bound)
+        return float(self.buckets[-1])  # Slower than the biggest bucket
+
+    def snapshot(self):
+        cumulative, total = [], 0
+        for n in self.counts:
+            total += n
+            cumulative.append(total)
+        return {
+            'count': self.count,
+            'mean_ms': self.sum / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'sum_ms': self.sum,
+            'buckets': list(zip(self.buckets + ('+Inf',), cumulative)),
+        }
+
+
+class RateMeter:
+    """Events per second over the last few seconds"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self.times = collections.deque()
+
+    def tick(self):
+        now = time.monotonic()
+        self.times.append(now)
+        while self.times and self.times[0] < now - self.window:
+            self.times.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        recent = [t for t in list(self.times) if t >= now - self.window]
+        return len(recent) / self.window
+
+
+class StreamMetrics:
+    """Everything measured for one stream"""
+
+    def __init__(self):
+        self.stages = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+        self.rates = collections.defaultdict(RateMeter)
+
+    def observe(self, stage, seconds):
+        self.stages[stage].observe(seconds * 1000.0)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def tick(self, name):
+        self.rates[name].tick()
+
+    def snapshot(self):
+        counters = dict(self.counters)
+        processed = counters.get('frames_processed', 0)
+        return {
+            'fps': {name: meter.rate() for name, meter in list(self.rates.items())},
+            'stages': {name: h.snapshot() for name, h in list(self.stages.items())},
+            'counters': counters,
+            'detections_per_frame': {
+                name: counters.get(name, 0) / processed if processed else 0.0
+                for name in ('faces', 'id_cards')
+            },
+        }
+
+
+class FrameRecorder:
+    """Collects one frame's records in a worker process, to replay in the parent"""
+
+    def __init__(self):
+        self.items = []
+
+    def observe(self, stage, seconds):
+        self.items.append(('observe', stage, seconds))
+
+    def count(self, name, n=1):
+        self.items.append(('count', name, n))
+
+
+_local = threading.local()
+
+
+def bind(sink):
+    """Send this thread's record() / count() calls to sink (a StreamMetrics)"""
+    _local.sink = sink
+
+
+def record(stage, seconds):
+    """Record how long a stage took, for the stream this thread is working on"""
+    sink = getattr(_local, 'sink', None)
+    if sink is not None:
+        sink.observe(stage, seconds)
+
+
+def count(name, n=1):
+    sink = getattr(_local, 'sink', None)
+    if sink is not None:
+        sink.count(name, n)
+
+
+def replay(items):
+    """Record what a FrameRecorder collected in another process"""
+    for kind, name, value in items:
+        if kind == 'observe':
+            record(name, value)
+        else:
+            count(name, value)
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_prometheus(stats):
+    """Prometheus text format for {stream_id: pipeline.stats()}"""
+    lines = ['# TYPE privacy_stage_latency_ms histogram']
+    for stream, s in stats.items():
+        for stage, h in s['stages'].items():
+            for bound, n in h['buckets']:
+                lines.append(f'privacy_stage_latency_ms_bucket{{{_labels(stream=stream, stage=stage, le=bound)}}} {n}')
+            lines.append(f'privacy_stage_latency_ms_sum{{{_labels(stream=stream, stage=stage)}}} {h["sum_ms"]}')
+            lines.append(f'privacy_stage_latency_ms_count{{{_labels(stream=stream, stage=stage)}}} {h["count"]}')
+
+    lines.append('# TYPE privacy_fps gauge')
+    for stream, s in stats.items():
+        for name, fps in s['fps'].items():
+            lines.append(f'privacy_fps{{{_labels(stream=stream, kind=name)}}} {fps}')
+
+    lines.append('# TYPE privacy_events_total counter')
+    for stream, s in stats.items():
+        for name, n in s['counters'].items():
+            lines.append(f'privacy_events_total{{{_labels(stream=stream, event=name)}}} {n}')
+
+    for name, key, kind in (('queue_depth', 'depth', 'gauge'),
+                            ('queue_dropped_total', 'dropped', 'counter')):
+        lines.append(f'# TYPE privacy_{name} {kind}')
+        for stream, s in stats.items():
+            for queue, q in s['queues'].items():
+                lines.append(f'privacy_{name}{{{_labels(stream=stream, queue=queue)}}} {q[key]}')
+
+    lines.append('# TYPE privacy_ring_frames_total counter')
+    for stream, s in stats.items():
+        for stage, counters in s['ring']['stages'].items():
+            for outcome, n in counters.items():
+                lines.append(f'privacy_ring_frames_total{{{_labels(stream=stream, stage=stage, outcome=outcome)}}} {n}')
+
+    lines.append('# TYPE privacy_viewers gauge')
+    for stream, s in stats.items():
+        lines.append(f'privacy_viewers{{{_labels(stream=stream)}}} {s["viewers"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,264 @@
+"""
+Model Backends
+Loads the face and ID card YOLO models for one of three runtimes:
+    torch    - PyTorch eager (the plain .pt weights)
+    onnx     - ONNX Runtime, exported from the .pt weights
+    openvino - Intel OpenVINO, exported from the .pt weights (fastest on Intel CPUs)
+
+Exported models use a fixed input shape (imgsz x imgsz). OpenVINO models can
+also be FP16 or INT8; the others run FP32 on the CPU (see SUPPORTED_PRECISIONS).
+Every model gets a warmup pass so the first real frame isn't slow.
+
+Optimized artifacts (fused torch checkpoints, exported ONNX / OpenVINO models)
+are cached on disk in MODEL_CACHE_DIR, keyed by the weights file and the
+export options, so restarts skip the export and fusing work. A cache entry
+is built in a private folder and renamed into place under a lock file, so
+worker processes that all miss the cache at once build it only once and never
+see half-written files. ModelLoader
+loads models on a background thread so the web server can start right away.
+
+Compare the backends on a clip with:
+    python models.py --clip my_video.mp4 --imgsz 480
+"""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+
+try:
+    import fcntl  # Not available on Windows
+except ImportError:
+    fcntl = None
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+PRECISIONS = ('fp32', 'fp16', 'int8')
+# What each backend really produces on a CPU. ONNX export ignores half= without
+# a GPU and has no int8, and torch runs the weights as they are.
+SUPPORTED_PRECISIONS = {
+    'torch': ('fp32',),
+    'onnx': ('fp32',),
+    'openvino': ('fp32', 'fp16', 'int8'),
+}
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', 'model_cache')
+
+
+def cache_path(weights, backend, imgsz, precision, cache_dir=MODEL_CACHE_DIR):
+    """Cache location for one optimized model.
+    The key changes whenever the weights file or the options change."""
+    stat = os.stat(weights)
+    key = f"{os.path.abspath(weights)}|{stat.st_size}|{stat.st_mtime_ns}|{backend}|{imgsz}|{precision}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    suffix = {'torch': '-fused.pt', 'onnx': '.onnx', 'openvino': '_openvino_model'}[backend]
+    return os.path.join(cache_dir, f"{stem}-{digest}{suffix}")
+
+
+@contextlib.contextmanager
+def cache_lock(path):
+    """Only one process at a time builds the cache entry at path.
+    Without fcntl (Windows) builds may run twice, but the rename keeps them safe."""
+    with open(path + '.lock', 'w') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file closes
+        yield
+
+
+def export_model(weights, backend, imgsz=640, precision='fp32', int8_data=None):
+    """Export .pt weights to ONNX / OpenVINO with a fixed input shape"""
+    from ultralytics import YOLO
+
+    print(f"Exporting {weights} to {backend} ({precision}, {imgsz}x{imgsz})...")
+    args = dict(format=backend, imgsz=imgsz, dynamic=False, batch=1,
+                half=precision == 'fp16', int8=precision == 'int8')
+    if precision == 'int8' and int8_data:
+        args['data'] = int8_data  # Calibration dataset yaml
+    return YOLO(weights).export(**args)
+
+
+def load_model(weights, backend='torch', imgsz=640, precision='fp32', int8_data=None,
+               cache_dir=MODEL_CACHE_DIR):
+    """Load one YOLO model for the chosen backend.
+    Uses the on-disk cache, exporting / fusing the model only on a cache miss."""
+    from ultralytics import YOLO  # Heavy import, only paid when a model is needed
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (use one of {BACKENDS})")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (use one of {PRECISIONS})")
+    if precision not in SUPPORTED_PRECISIONS[backend]:
+        # Otherwise an fp32 model would be cached and reported as fp16 / int8
+        raise ValueError(f"{backend} can't run {precision} here "
+                         f"(use one of {SUPPORTED_PRECISIONS[backend]})")
+
+    path = cache_path(weights, backend, imgsz, precision, cache_dir)
+    if os.path.exists(path):
+        return YOLO(path, task='detect')
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with cache_lock(path):
+        if os.path.exists(path):  # Another process built it while we waited
+            return YOLO(path, task='detect')
+
+        # Build in a private folder, then rename: the cache never holds half a model
+        work = tempfile.mkdtemp(prefix='.build-', dir=cache_dir)
+        try:
+            if backend == 'torch':
+                # Fuse Conv + BatchNorm once and keep the result
+                model = YOLO(weights)
+                try:
+                    model.fuse()
+                    built = os.path.join(work, os.path.basename(path))
+                    model.save(built)
+                    os.replace(built, path)
+                except Exception as e:  # Older ultralytics without YOLO.save()
+                    print(f"Could not cache fused model: {e}")
+                return model
+
+            # ultralytics exports next to the weights, so export a private copy
+            local = shutil.copy(weights, work)
+            exported = export_model(local, backend, imgsz, precision, int8_data)
+            try:
+                os.replace(exported, path)
+            except OSError:
+                if not os.path.exists(path):  # Not a build that finished first (no lock)
+                    raise
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+    return YOLO(path, task='detect')
+
+
+def max_batch_size(backend):
+    """Exported models have a fixed batch of 1; torch takes any batch size"""
+    return None if backend == 'torch' else 1
+
+
+def warmup(model, imgsz=640, runs=2):
+    """Run a few dummy frames so the first real frame isn't slow"""
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(runs):
+        model.predict(source=dummy, imgsz=imgsz, verbose=False)
+
+
+class ModelLoader:
+    """Loads models on a background thread.
+    The web server answers right away; streams wait for the models with get()."""
+
+    def __init__(self, load):
+        self.load = load  # Function that loads and warms up the models
+        self.models = None
+        self.error = None
+        self.started_at = None
+        self.load_seconds = None
+        self.loaded = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Begin loading in the background (does nothing if already started)"""
+        with self.lock:
+            if self.started_at is not None:
+                return
+            self.started_at = time.monotonic()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def get(self, timeout=None):
+        """The loaded models - starts loading and waits if needed"""
+        self.start()
+        if not self.loaded.wait(timeout):
+            raise TimeoutError("Models are still loading")
+        if self.error:
+            raise RuntimeError(f"Model loading failed: {self.error}")
+        return self.models
+
+    def status(self):
+        if self.started_at is None:
+            state = 'not_started'
+        elif not self.loaded.is_set():
+            state = 'loading'
+        else:
+            state = 'error' if self.error else 'ready'
+        return {'state': state, 'load_seconds': self.load_seconds,
+                'error': str(self.error) if self.error else None}
+
+    def _run(self):
+        print("Loading models...")
+        try:
+            self.models = self.load()
+            print("Models loaded!")
+        except Exception as e:
+            self.error = e
+            print(f"Error: Could not load models: {e}")
+        self.load_seconds = time.monotonic() - self.started_at
+        self.loaded.set()
+
+
+def read_clip(path, size, max_frames):
+    """Frames of a video file resized to size (width, height)"""
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, size))
+    cap.release()
+    return frames
+
+
+def benchmark_backends(weights_list, frames, backends=BACKENDS, imgsz=640, precision='fp32'):
+    """Per-frame latency of every model on every backend, on the same frames.
+    Returns {backend: {weights: {'mean_ms', 'p50_ms', 'p95_ms'}}}"""
+    results = {}
+    for backend in backends:
+        results[backend] = {}
+        for weights in weights_list:
+            try:
+                model = load_model(weights, backend, imgsz, precision)
+            except Exception as e:  # Runtime not installed, export failed...
+                print(f"Skipping {backend} for {weights}: {e}")
+                continue
+            warmup(model, imgsz)
+
+            times = []
+            for frame in frames:
+                start = time.perf_counter()
+                model.predict(source=frame, imgsz=imgsz, verbose=False)
+                times.append((time.perf_counter() - start) * 1000)
+            results[backend][weights] = {
+                'mean_ms': float(np.mean(times)),
+                'p50_ms': float(np.percentile(times, 50)),
+                'p95_ms': float(np.percentile(times, 95)),
+            }
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-frame latency of each inference backend")
+    parser.add_argument('--clip', required=True, help="video file to replay")
+    parser.add_argument('--weights', nargs='+', default=["yolov8n-face-lindevs.pt", "best.pt"])
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--imgsz', type=int, default=480)
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS)
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+
+    height = int(args.imgsz * 3 / 4)
+    frames = read_clip(args.clip, (args.imgsz, height), args.frames)
+    if not frames:
+        raise SystemExit(f"Could not read any frames from {args.clip}")
+
+    results = benchmark_backends(args.weights, frames, args.backends, args.imgsz, args.precision)
+    print(f"\n{len(frames)} frames, imgsz={args.imgsz}, {args.precision}")
+    print(f"{'backend':<10}{'model':<28}{'mean':>10}{'p50':>10}{'p95':>10}")
+    for backend, models in results.items():
+        for weights, t in models.items():
+            print(f"{backend:<10}{weights:<28}{t['mean_ms']:>8.1f}ms"
+                  f"{t['p50_ms']:>8.1f}ms{t['p95_ms']:>8.1f}ms")
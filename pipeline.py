@@ -0,0 +1,632 @@
+"""
+Threaded Frame Pipeline
+Camera capture, AI processing and JPEG encoding each run on their own thread.
+The stages are joined by small "latest frame wins" queues, so a slow YOLO pass
+never stalls the camera and the viewer always gets the freshest frame.
+Encoded frames are broadcast, so any number of viewers share one pipeline.
+Frames live in a per-stream shared memory ring of preallocated slots, and the
+stages pass (slot, sequence number) pairs instead of arrays - so a worker
+process can read and write them without any copy. Viewers that drain the stream slowly get smaller, lower
+quality frames instead of a growing backlog. With a change detector, static
+scenes skip the AI and the encode and re-send the last JPEG. When the camera
+drops out, the capture stage reconnects with exponential backoff.
+With live settings the frame resolution can change from one frame to the
+next, and a quality governor can tune it to hold a target fps.
+Viewers can read the stream from a thread (subscribe) or from an asyncio
+event loop (subscribe_async), where each viewer costs a coroutine, not a thread.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+import cv2
+import numpy as np
+
+import metrics
+from buffers import SharedFrameRing
+from capture import default_pool as default_capture_pool
+from encoding import AdaptiveQuality, default_pool, quality_tiers
+
+# Sent through the pipeline instead of a frame when nothing changed
+REPEAT_LAST = object()
+
+# Frames in a row a stage may fail before the stream is stopped
+MAX_FAILED_FRAMES = 30
+
+# Every JPEG goes out as one part of a multipart/x-mixed-replace response
+MJPEG_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_TRAILER = b'\r\n'
+
+
+class LatestQueue:
+    """Bounded queue that drops the oldest item when it is full"""
+
+    def __init__(self, maxsize=1, on_drop=None):
+        self._items = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.on_drop = on_drop  # Called with each item that gets thrown away
+        self.dropped = 0
+
+    def put(self, item):
+        dropped = None
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                dropped = self._items.popleft()  # Oldest frame is thrown away
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None if nothing arrived in time"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FrameBroadcaster:
+    """Holds the newest encoded frame and wakes every subscriber when it changes"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._closed = False
+        self._listeners = []  # Called after every publish / close
+
+    def publish(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener):
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def latest(self):
+        """(seq, frame) right now, without waiting"""
+        with self._cond:
+            return self._seq, self._frame
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def wait(self, last_seq, timeout=None):
+        """Wait for a frame newer than last_seq. Returns (seq, frame)"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq != last_seq or self._closed, timeout)
+            return self._seq, self._frame
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class AsyncBridge:
+    """Wakes asyncio viewers when the broadcaster publishes a frame.
+    The capture threads make one call into the event loop per frame, and
+    every viewer on that loop waits on the same future."""
+
+    def __init__(self, broadcaster, loop):
+        self.broadcaster = broadcaster
+        self.loop = loop
+        self.waiter = loop.create_future()
+        broadcaster.add_listener(self._on_publish)
+
+    def _on_publish(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        waiter, self.waiter = self.waiter, self.loop.create_future()
+        waiter.set_result(None)
+
+    async def wait(self, last_seq, timeout=None):
+        """Async version of FrameBroadcaster.wait()"""
+        seq, frame = self.broadcaster.latest()
+        if seq == last_seq and not self.broadcaster.closed:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.waiter), timeout)
+            except asyncio.TimeoutError:
+                pass
+            seq, frame = self.broadcaster.latest()
+        return seq, frame
+
+    def close(self):
+        self.broadcaster.remove_listener(self._on_publish)
+
+
+class ViewerQuality:
+    """Tracks one viewer's quality tier, and how many viewers are on a lower
+    tier so the encoder only keeps a copy for re-encoding when it is needed"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.controller = (AdaptiveQuality(len(pipeline.tiers))
+                           if pipeline.adaptive_quality else None)
+        self.on_lower_tier = False
+
+    @property
+    def tier(self):
+        return self.controller.tier if self.controller else 0
+
+    def sent(self, seconds):
+        """Record how long the last chunk took to send"""
+        if self.controller is None:
+            return
+        # The send time tells us how fast this viewer drains the stream
+        tier = self.controller.update(seconds, self.pipeline.frame_interval)
+        if (tier > 0) != self.on_lower_tier:
+            self.on_lower_tier = tier > 0
+            with self.pipeline.tier_lock:
+                self.pipeline.tier_users += 1 if self.on_lower_tier else -1
+
+    def close(self):
+        if self.on_lower_tier:
+            with self.pipeline.tier_lock:
+                self.pipeline.tier_users -= 1
+            self.on_lower_tier = False
+
+
+class FramePipeline:
+    """Capture -> process -> encode, one thread per stage.
+    process(frame, output) must draw its result into output and return it.
+    With settings (a StreamSettings) the frame width follows its 'resolution'
+    value, up to max_size; the height keeps the aspect ratio of size."""
+
+    def __init__(self, url, process, size, jpeg_quality=85,
+                 process_every_n=1, buffer_size=None, queue_size=1,
+                 encoder=None, adaptive_quality=True, change_detector=None,
+                 capture_pool=None, reconnect_delay=0.5, max_reconnect_delay=30.0,
+                 settings=None, max_size=None, governor=None):
+        self.url = url
+        self.process = process
+        self.size = size
+        self.max_size = max_size or size
+        self.settings = settings
+        self.governor = governor  # Tunes the settings to hold a target fps
+        self.jpeg_quality = jpeg_quality
+        self.process_every_n = process_every_n
+        self.buffer_size = buffer_size
+        self.encoder = encoder or default_pool()
+        self.change_detector = change_detector  # Skips the AI on static scenes
+        self.last_part = None
+
+        # Camera connection - reuses the handle opened by the /set_camera probe
+        self.capture_pool = capture_pool or default_capture_pool()
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        self.reconnects = 0
+
+        # Per-viewer adaptive quality: slow viewers get a lighter tier
+        self.adaptive_quality = adaptive_quality
+        self.tiers = quality_tiers(jpeg_quality)
+        self.frame_interval = 1 / 15.0
+        self.tier_users = 0
+        self.tier_lock = threading.Lock()
+        self.tier_source = None
+        self.tier_seq = 0
+        self.tier_cache = {}
+
+        # Enough slots for capture, process (in + out), encode and both queues.
+        # Slots fit the biggest allowed frame; smaller frames use the start of one.
+        width, height = self.max_size
+        self.ring = SharedFrameRing((height, width, 3), slots=4 + 2 * queue_size + 2)
+        self.captured_at = np.zeros(self.ring.slots)  # Capture time of each slot's frame
+        self.slot_shapes = [None] * self.ring.slots   # Shape of each slot's frame
+        # Frames dropped from a queue go straight back to the ring
+        self.raw_frames = LatestQueue(queue_size, on_drop=self._drop)
+        self.processed_frames = LatestQueue(queue_size, on_drop=self._drop)
+        self.broadcaster = FrameBroadcaster()
+        self.metrics = metrics.StreamMetrics()
+        self.async_bridge = None  # Created by the first asyncio viewer
+        self.subscribers = 0
+        self.lock = threading.Lock()
+
+        self.cap = None
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.stages_running = 0
+        self.ring_closed = False
+
+    @property
+    def running(self):
+        return not self.stop_event.is_set()
+
+    def start(self):
+        """Open the camera and start all stages. Returns False if it can't connect"""
+        self.cap = self._connect()
+        if self.cap is None:
+            return False
+
+        self.stages_running = 3
+        for target in (self._capture_stage, self._process_loop, self._encode_loop):
+            thread = threading.Thread(target=self._run_stage, args=(target,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return True
+
+    def _run_stage(self, loop):
+        """Run one stage's loop. The last stage to exit frees the ring"""
+        try:
+            loop()
+        finally:
+            with self.lock:
+                self.stages_running -= 1
+            self._close_ring_if_idle()
+
+    def _close_ring_if_idle(self):
+        """Free the ring once stopped and no stage thread can touch it any more.
+        A stage can outlive stop()'s join (slow inference, a blocked camera
+        read), and writing into an unmapped ring would crash the process."""
+        with self.lock:
+            if self.running or self.stages_running or self.ring_closed:
+                return
+            self.ring_closed = True
+        self.ring.close()
+
+    def stop(self):
+        """Stop all stages. The capture thread releases the camera on its way out"""
+        self.stop_event.set()
+        self.broadcaster.close()
+        if self.async_bridge is not None:
+            self.async_bridge.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self.threads = []
+        # Processors running in a worker process free their state there
+        close = getattr(self.process, 'close', None)
+        if close:
+            close()
+        self._close_ring_if_idle()  # Otherwise the last stage to exit does it
+
+    def stats(self):
+        """Timings, frame rates, counters and queue depths of this stream"""
+        stats = self.metrics.snapshot()
+        stats['queues'] = {
+            'raw': {'depth': len(self.raw_frames), 'dropped': self.raw_frames.dropped},
+            'processed': {'depth': len(self.processed_frames),
+                          'dropped': self.processed_frames.dropped},
+        }
+        stats['ring'] = self.ring.stats()
+        stats['viewers'] = self.subscribers
+        stats['reconnects'] = self.reconnects
+        if self.change_detector:
+            stats['change_detector'] = self.change_detector.stats()
+        if self.settings:
+            stats['settings'] = self.settings.snapshot()
+        if self.governor:
+            stats['governor'] = self.governor.status
+        return stats
+
+    def frame_size(self):
+        """(width, height) of the next frame - follows the live resolution setting"""
+        if self.settings is None:
+            return self.size
+        width = min(self.settings.snapshot().get('resolution', self.size[0]), self.max_size[0])
+        height = min(int(width * self.size[1] / self.size[0]), self.max_size[1])
+        return width, height
+
+    def _drop(self, item):
+        if item is not REPEAT_LAST:
+            self.ring.drop(item)
+
+    def _connect(self):
+        """Open the camera (or take the probed handle). Returns None on failure"""
+        cap = self.capture_pool.connect(self.url)
+        if cap is not None and self.buffer_size:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+        self.connected = cap is not None
+        return cap
+
+    def _reconnect(self):
+        """Reopen the camera, waiting longer after each failed attempt.
+        Returns False if the pipeline was stopped while waiting."""
+        self.connected = False
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+        delay = self.reconnect_delay
+        while self.running:
+            print(f"Lost camera {self.url}, reconnecting in {delay:.1f}s")
+            if self.stop_event.wait(delay):
+                return False
+            self.cap = self._connect()
+            if self.cap is not None:
+                self.reconnects += 1
+                print(f"Reconnected to camera {self.url}")
+                return True
+            delay = min(delay * 2, self.max_reconnect_delay)
+        return False
+
+    def attach(self):
+        """Register a viewer. Returns False if the pipeline already stopped"""
+        with self.lock:
+            if not self.running:
+                return False
+            self.subscribers += 1
+            return True
+
+    def detach(self):
+        """Unregister a viewer. Returns how many viewers are left"""
+        with self.lock:
+            self.subscribers -= 1
+            return self.subscribers
+
+    def subscribe(self, timeout=1.0):
+        """Yield each new multipart JPEG chunk until the pipeline stops.
+        A slow viewer just gets the newest frame when it comes back,
+        so it never holds back the capture or the other viewers.
+        How long each chunk takes to send picks the viewer's quality tier."""
+        viewer = ViewerQuality(self)
+        seq = 0
+        try:
+            while self.running:
+                new_seq, part = self.broadcaster.wait(seq, timeout)
+                if new_seq == seq or part is None:
+                    continue
+                seq = new_seq
+
+                if viewer.tier > 0:
+                    part = self.tier_part(seq, viewer.tier) or part
+
+                start = time.monotonic()
+                yield part
+                viewer.sent(time.monotonic() - start)
+        finally:
+            viewer.close()
+
+    async def subscribe_async(self, timeout=1.0):
+        """Async generator version of subscribe() for an asyncio server.
+        Lower tier encodes run on a worker thread so the event loop never blocks."""
+        loop = asyncio.get_running_loop()
+        if self.async_bridge is None or self.async_bridge.loop is not loop:
+            self.async_bridge = AsyncBridge(self.broadcaster, loop)
+        bridge = self.async_bridge
+
+        viewer = ViewerQuality(self)
+        seq = 0
+        try:
+            while self.running:
+                new_seq, part = await bridge.wait(seq, timeout)
+                if new_seq == seq or part is None:
+                    continue
+                seq = new_seq
+
+                if viewer.tier > 0:
+                    lower = await loop.run_in_executor(None, self.tier_part, seq, viewer.tier)
+                    part = lower or part
+
+                start = time.monotonic()
+                yield part
+                viewer.sent(time.monotonic() - start)
+        finally:
+            viewer.close()
+
+    def tier_part(self, seq, tier):
+        """The frame with this sequence number re-encoded for a lower tier.
+        Encoded once per tier and shared by every viewer on it."""
+        with self.tier_lock:
+            if seq != self.tier_seq or self.tier_source is None:
+                return None
+            if tier not in self.tier_cache:
+                scale, quality = self.tiers[tier]
+                jpeg = self.encoder.encode(self.tier_source, quality, scale)
+                self.tier_cache[tier] = b''.join((MJPEG_HEADER, jpeg, MJPEG_TRAILER))
+            return self.tier_cache[tier]
+
+    def _frame_failed(self, stage, error, failures):
+        """Log a frame that a stage couldn't handle. When a stage keeps failing
+        (model didn't load, worker process died) the pipeline stops, so the
+        viewers' streams end instead of waiting forever.
+        Returns True when the stage should give up."""
+        self.metrics.count(f'{stage}_errors')
+        if failures == 1 or failures % 10 == 0:
+            print(f"Error in {stage} stage of {self.url}: {error!r}")
+        if failures < MAX_FAILED_FRAMES:
+            return False
+        print(f"{stage} stage of {self.url} failed {failures} frames in a row, stopping the stream")
+        self.stop()
+        return True
+
+    def _capture_stage(self):
+        """The capture loop, then release the camera from this same thread.
+        Releasing from another thread while read() blocks is unsafe in OpenCV's
+        backends, and a reconnect that finished after stop() must not leak."""
+        try:
+            self._capture_loop()
+        finally:
+            cap, self.cap = self.cap, None
+            if cap is not None:
+                cap.release()
+            self.connected = False
+
+    def _capture_loop(self):
+        """Read frames as fast as the camera delivers them"""
+        frame_count = 0
+        frame = None
+        stream = self.metrics
+        failures = 0
+        while self.running:
+            start = time.perf_counter()
+            ret, frame = self.cap.read(frame)  # Reuses the last frame's array
+            if not self.running:
+                break  # Stopped while waiting for the camera
+            if not ret:
+                frame = None
+                if not self._reconnect():
+                    break
+                continue
+
+            frame_count += 1
+            stream.observe('read', time.perf_counter() - start)  # Includes waiting for the camera
+            stream.tick('captured')
+
+            # Process every Nth frame based on settings
+            if frame_count % self.process_every_n != 0:
+                continue
+            stream.tick('offered')  # The most the stream can publish (for the governor)
+
+            # Resize for faster processing, straight into a ring slot
+            start = time.perf_counter()
+            slot = None
+            try:
+                width, height = self.frame_size()
+                slot = self.ring.acquire()
+                shape = (height, width, 3)
+                cv2.resize(frame, (width, height), dst=self.ring.frame(slot, shape))
+                self.slot_shapes[slot] = shape
+                self.captured_at[slot] = time.monotonic()
+                published = self.ring.publish(slot, 'process')
+                slot = None
+                self.raw_frames.put(published)
+                failures = 0
+            except Exception as e:
+                if slot is not None:
+                    self.ring.release(slot)
+                failures += 1
+                if self._frame_failed('capture', e, failures):
+                    break
+                continue
+            stream.observe('resize', time.perf_counter() - start)
+
+    def _process_loop(self):
+        """Run the AI on the newest frame, skipping any that piled up"""
+        process_slots = getattr(self.process, 'process_slots', None)
+        stream = self.metrics
+        metrics.bind(stream)  # The processor's own timings go to this stream
+        failures = 0
+        while self.running:
+            item = self.raw_frames.get(timeout=0.5)
+            if item is None or not self.ring.take(item):
+                continue  # Nothing new, or the slot was already overwritten
+            slot = item[0]
+            out_slot = None
+            try:
+                shape = self.slot_shapes[slot]
+                frame = self.ring.frame(slot, shape)
+
+                # Static scene - reuse the last detections and JPEG
+                if self.change_detector and not self.change_detector.changed(frame):
+                    self.ring.release(slot)
+                    slot = None
+                    self.processed_frames.put(REPEAT_LAST)
+                    stream.count('frames_reused')
+                    continue
+
+                # The processor writes its result into another ring slot
+                start = time.perf_counter()
+                out_slot = self.ring.acquire()
+                if process_slots:
+                    # Worker processes read and write the ring directly
+                    process_slots(self.ring, slot, out_slot, shape)
+                else:
+                    output = self.ring.frame(out_slot, shape)
+                    result = self.process(frame, output)
+                    if not self.running:
+                        break  # Stopped during a slow model call
+                    if result is not output:
+                        np.copyto(output, result)
+                self.slot_shapes[out_slot] = shape
+                self.captured_at[out_slot] = self.captured_at[slot]
+                self.ring.release(slot)
+                slot = None
+                published = self.ring.publish(out_slot, 'encode')
+                out_slot = None
+                self.processed_frames.put(published)
+                failures = 0
+            except Exception as e:
+                # Give the slots back and carry on with the next frame
+                if slot is not None:
+                    self.ring.release(slot)
+                if out_slot is not None:
+                    self.ring.release(out_slot)
+                failures += 1
+                if self._frame_failed('process', e, failures):
+                    break
+                continue
+            stream.observe('process', time.perf_counter() - start)
+            stream.count('frames_processed')
+            stream.tick('processed')
+
+    def _encode_loop(self):
+        """Encode processed frames to JPEG on the shared encoder pool"""
+        last_publish = time.monotonic()
+        stream = self.metrics
+        failures = 0
+        while self.running:
+            item = self.processed_frames.get(timeout=0.5)
+            if item is None:
+                continue
+
+            if item is REPEAT_LAST:
+                if self.last_part is not None:
+                    # Same picture, so lower tier encodes stay valid too
+                    with self.tier_lock:
+                        if self.tier_seq == self.broadcaster.seq:
+                            self.tier_seq += 1
+                    self.broadcaster.publish(self.last_part)
+                    stream.tick('published')
+                continue
+
+            if not self.ring.take(item):
+                continue
+            try:
+                start = time.perf_counter()
+                output = self.ring.frame(item[0], self.slot_shapes[item[0]])
+                captured_at = self.captured_at[item[0]]
+                jpeg = self.encoder.encode(output, self.jpeg_quality)
+                stream.observe('encode', time.perf_counter() - start)
+
+                # Keep a copy for lower tiers, but only while some viewer is on one
+                if self.tier_users:
+                    with self.tier_lock:
+                        if self.tier_source is None or self.tier_source.shape != output.shape:
+                            self.tier_source = np.empty_like(output)
+                        np.copyto(self.tier_source, output)
+                        self.tier_cache = {}
+                        self.tier_seq = self.broadcaster.seq + 1
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if self._frame_failed('encode', e, failures):
+                    break
+                continue
+            finally:
+                self.ring.release(item[0])
+
+            if jpeg is not None:
+                # Build the multipart chunk once for all viewers, with a single copy
+                self.last_part = b''.join((MJPEG_HEADER, jpeg, MJPEG_TRAILER))
+                self.broadcaster.publish(self.last_part)
+
+                now = time.monotonic()
+                stream.observe('end_to_end', now - captured_at)  # Capture to viewers
+                stream.tick('published')
+                if self.governor:
+                    self.governor.frame_done(now - captured_at, stream)
+                self.frame_interval = 0.9 * self.frame_interval + 0.1 * (now - last_publish)
+                last_publish = now
@@ -0,0 +1,208 @@
+"""
+Redaction Compositing
+Instead of blurring every box on its own, all boxes of one class are merged
+into a single mask. The area they cover is redacted once (blurs work on a
+downscaled copy, which is much cheaper) and blended back through the mask in
+one pass. Overlapping boxes are only redacted once, and the cost barely
+changes with the number of boxes.
+
+Redaction kernels are pluggable per class: gaussian, box, pixelate, resize
+and fill. Run "python redaction.py" to see what each one costs per ROI.
+"""
+
+import time
+import cv2
+import numpy as np
+
+
+def box_mask(shape, boxes):
+    """Union of all boxes as a boolean mask, built without a per-box loop.
+    Each box adds +1/-1 at its corners, and two cumulative sums fill it in."""
+    height, width = shape[:2]
+    mask = np.zeros((height, width), dtype=bool)
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if not len(boxes):
+        return mask
+
+    x1 = np.clip(boxes[:, 0], 0, width)
+    y1 = np.clip(boxes[:, 1], 0, height)
+    x2 = np.clip(boxes[:, 2], 0, width)
+    y2 = np.clip(boxes[:, 3], 0, height)
+
+    diff = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.add.at(diff, (y1, x1), 1)
+    np.add.at(diff, (y1, x2), -1)
+    np.add.at(diff, (y2, x1), -1)
+    np.add.at(diff, (y2, x2), 1)
+    np.greater(diff.cumsum(axis=0).cumsum(axis=1)[:height, :width], 0, out=mask)
+    return mask
+
+
+def union_rect(boxes, shape, margin=0):
+    """Smallest rectangle holding every box (plus a margin), clipped to the frame"""
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    height, width = shape[:2]
+    x1 = max(int(boxes[:, 0].min()) - margin, 0)
+    y1 = max(int(boxes[:, 1].min()) - margin, 0)
+    x2 = min(int(boxes[:, 2].max()) + margin, width)
+    y2 = min(int(boxes[:, 3].max()) + margin, height)
+    return x1, y1, x2, y2
+
+
+class RedactionKernel:
+    """Base class - a kernel turns an image area into its redacted version"""
+
+    margin = 0  # Extra pixels around the boxes the kernel needs to look at
+
+    def __call__(self, image):
+        raise NotImplementedError
+
+    def apply(self, area, mask):
+        """Redact the masked pixels of area in place"""
+        np.copyto(area, self(area), where=mask[..., None])
+
+
+class GaussianBlur(RedactionKernel):
+    """Gaussian blur done at 1/downscale size and scaled back up.
+    Looks about the same as a full-size blur for a fraction of the cost."""
+
+    def __init__(self, strength=23, sigma=None, downscale=4):
+        self.ksize = strength
+        self.sigma = strength if sigma is None else sigma
+        self.downscale = downscale
+        self.margin = strength
+
+    def __call__(self, image):
+        height, width = image.shape[:2]
+        small_w, small_h = max(width // self.downscale, 1), max(height // self.downscale, 1)
+        small = cv2.resize(image, (small_w, small_h), interpolation=cv2.INTER_AREA)
+
+        k = max(self.ksize // self.downscale, 1) | 1  # Kernel size must be odd
+        small = cv2.GaussianBlur(small, (k, k), self.sigma / self.downscale)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+class BoxBlur(GaussianBlur):
+    """Box (or stack) blur - flat kernel, cheaper than Gaussian on CPU"""
+
+    def __call__(self, image):
+        height, width = image.shape[:2]
+        small_w, small_h = max(width // self.downscale, 1), max(height // self.downscale, 1)
+        small = cv2.resize(image, (small_w, small_h), interpolation=cv2.INTER_AREA)
+
+        k = max(self.ksize // self.downscale, 1) | 1
+        if hasattr(cv2, 'stackBlur'):  # OpenCV 4.7+
+            small = cv2.stackBlur(small, (k, k))
+        else:
+            small = cv2.blur(small, (k, k))
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+class Pixelate(RedactionKernel):
+    """Big square blocks - strength is the block size in pixels"""
+
+    def __init__(self, strength=16):
+        self.block = max(strength, 1)
+
+    def __call__(self, image):
+        height, width = image.shape[:2]
+        small_w, small_h = max(width // self.block, 1), max(height // self.block, 1)
+        small = cv2.resize(image, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+
+class ResizeBlur(RedactionKernel):
+    """Shrink and stretch back - strength is the shrink factor"""
+
+    def __init__(self, strength=8):
+        self.factor = max(strength, 1)
+
+    def __call__(self, image):
+        height, width = image.shape[:2]
+        small_w, small_h = max(width // self.factor, 1), max(height // self.factor, 1)
+        small = cv2.resize(image, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+class SolidFill(RedactionKernel):
+    """Paint the region one color - fastest, and nothing can leak"""
+
+    def __init__(self, strength=None, color=(0, 0, 0)):
+        self.color = np.array(color, dtype=np.uint8)
+
+    def __call__(self, image):
+        return np.broadcast_to(self.color, image.shape)
+
+    def apply(self, area, mask):
+        area[mask] = self.color
+
+
+# Kernels by name, so apps can pick one per class with a setting
+KERNELS = {
+    'gaussian': GaussianBlur,
+    'box': BoxBlur,
+    'pixelate': Pixelate,
+    'resize': ResizeBlur,
+    'fill': SolidFill,
+}
+
+
+def make_kernel(name, strength=None, **params):
+    """Build a redaction kernel by name (gaussian, box, pixelate, resize, fill)"""
+    if name not in KERNELS:
+        raise ValueError(f"Unknown redaction kernel: {name}")
+    if strength is not None:
+        params['strength'] = strength
+    return KERNELS[name](**params)
+
+
+def redact_regions(output, layers):
+    """Redact every region in place.
+    layers is a list of (boxes, kernel) - one entry per class."""
+    for boxes, kernel in layers:
+        if not len(boxes):
+            continue
+
+        # Only the area around the boxes needs to be processed
+        x1, y1, x2, y2 = union_rect(boxes, output.shape, margin=kernel.margin)
+        if x2 <= x1 or y2 <= y1:
+            continue
+        area = output[y1:y2, x1:x2]
+
+        shifted = np.asarray(boxes, dtype=np.int64).reshape(-1, 4) - (x1, y1, x1, y1)
+        kernel.apply(area, box_mask(area.shape, shifted))
+    return output
+
+
+def benchmark_kernels(sizes=(64, 128, 256), repeats=200):
+    """Time every kernel on one ROI of each size. Returns {name: {size: ms}}"""
+    rng = np.random.default_rng(0)
+    results = {}
+    for name in KERNELS:
+        kernel = make_kernel(name)
+        results[name] = {}
+        for size in sizes:
+            frame = rng.integers(0, 256, (size * 2, size * 2, 3), dtype=np.uint8)
+            box = [(size // 2, size // 2, size // 2 + size, size // 2 + size)]
+            redact_regions(frame, [(box, kernel)])  # Warm up
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                redact_regions(frame, [(box, kernel)])
+            results[name][size] = (time.perf_counter() - start) * 1000 / repeats
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-ROI cost of each redaction kernel")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128, 256],
+                        help="square ROI sizes in pixels")
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    results = benchmark_kernels(args.sizes, args.repeats)
+    print(f"{'kernel':<10}" + "".join(f"{f'{s}x{s}':>12}" for s in args.sizes))
+    for name, timings in results.items():
+        print(f"{name:<10}" + "".join(f"{timings[s]:>10.3f}ms" for s in args.sizes))
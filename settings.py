@@ -0,0 +1,72 @@
+"""
+Live Settings
+Per-stream settings that can change while the stream runs. Every stage takes
+one snapshot() per frame, and update() swaps in a whole new dict, so a change
+lands on the next frame all at once - never halfway through a frame.
+
+The apps decide which settings exist through a LIMITS table:
+    {name: (type, lowest, highest)}
+"""
+
+import math
+import threading
+
+
+class StreamSettings:
+    """One stream's live settings, checked against limits"""
+
+    def __init__(self, limits, **values):
+        self.limits = limits
+        self.lock = threading.Lock()
+        self.values = self.validate(values)
+        self.version = 0  # Goes up on every change
+
+    def validate(self, changes):
+        """Checked and converted copy of changes. Raises ValueError"""
+        checked = {}
+        for name, value in changes.items():
+            if name not in self.limits:
+                raise ValueError(f"Unknown setting: {name}")
+            kind, low, high = self.limits[name]
+            value = self.convert(name, kind, value)
+            if low is not None and value < low or high is not None and value > high:
+                raise ValueError(f"{name} must be between {low} and {high}")
+            checked[name] = value
+        return checked
+
+    @staticmethod
+    def convert(name, kind, value):
+        """value as kind. Nothing is guessed: "false" is not a bool, 479.9 is not an int"""
+        if kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"{name} must be true or false")
+            return value
+        if isinstance(value, bool):
+            raise ValueError(f"{name} must be a number")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number")
+        if not math.isfinite(number):
+            raise ValueError(f"{name} must be a number")
+        if kind is int and not number.is_integer():
+            raise ValueError(f"{name} must be a whole number")
+        return kind(number)
+
+    def snapshot(self):
+        """The current settings. Never changed in place, so safe to keep for a frame"""
+        return self.values
+
+    def update(self, **changes):
+        """Apply changes together from the next frame on. Returns the new settings"""
+        checked = self.validate(changes)
+        with self.lock:
+            values = dict(self.values)
+            values.update(checked)
+            self.values = values
+            self.version += 1
+            return values
+
+    def load(self, values):
+        """Take over settings from another process as they are (worker processes)"""
+        self.values = values
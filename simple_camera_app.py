@@ -5,19 +5,90 @@ Just run this file and open http://localhost:5000 in your browser!
 
 from flask import Flask, render_template_string, Response, request, jsonify
 import cv2
-from ultralytics import YOLO
+import time
 import numpy as np
+from functools import partial
+from pipeline import FramePipeline
+from camera_manager import CameraManager
+from inference import BatchScheduler, result_boxes, upper_body_regions, detect_in_regions
+from tracking import SpeakerSelector
+from redaction import redact_regions, make_kernel
+from buffers import copy_into, rss_bytes
+from encoding import default_pool
+from change_detection import ChangeDetector
+from models import load_model, warmup, max_batch_size, ModelLoader
+from capture import CapturePool
+from asgi import make_asgi_app
+from workers import ProcessWorkerPool, in_worker
+import metrics
 
 app = Flask(__name__)
 
-# Load your YOLO models (make sure these files are in the same folder!)
-print("Loading models...")
-model_face = YOLO("yolov8n-face-lindevs.pt")
-model_idcard = YOLO("best.pt")
-print("Models loaded!")
+# Inference backend: torch, onnx or openvino ("python models.py" compares them)
+INFERENCE_BACKEND = 'torch'
+MODEL_PRECISION = 'fp32'  # fp32, fp16 or int8 (fp16 / int8 need openvino)
+MODEL_IMGSZ = 640         # Fixed input size of exported models
+
+# Load models in the background right at startup (False = wait for the first stream)
+WARMUP_ON_STARTUP = True
+
+def load_models():
+    """Load your YOLO models (make sure these files are in the same folder!)"""
+    model_face = load_model("yolov8n-face-lindevs.pt", INFERENCE_BACKEND, MODEL_IMGSZ, MODEL_PRECISION)
+    model_idcard = load_model("best.pt", INFERENCE_BACKEND, MODEL_IMGSZ, MODEL_PRECISION)
+    warmup(model_face, MODEL_IMGSZ)
+    warmup(model_idcard, MODEL_IMGSZ)
+    return model_face, model_idcard
+
+# Run detection + blur in this many worker processes (0 = threads in this process).
+# Helps CPU-only machines, where all streams share one GIL otherwise.
+PROCESS_WORKERS = 0
+THREADS_PER_WORKER = 1  # CPU cores each worker's model may use
+
+# The page is served right away; streams wait until the models are ready.
+# With PROCESS_WORKERS only the workers need the models.
+models = ModelLoader(load_models)
+if WARMUP_ON_STARTUP and (not PROCESS_WORKERS or in_worker()):
+    models.start()
+
+# Frames from all cameras are batched into one model call
+MAX_BATCH_SIZE = max_batch_size(INFERENCE_BACKEND) or 8  # Most frames per batch
+MAX_BATCH_WAIT_MS = 10  # Longest a frame waits for the batch to fill up
+# Results come back as box lists; ID cards of unrealistic sizes are dropped
+# right in the post-processing step
+face_scheduler = BatchScheduler(None, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS,
+                                postprocess=result_boxes,
+                                model_loader=lambda: models.get()[0])
+idcard_scheduler = BatchScheduler(None, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS,
+                                  postprocess=partial(result_boxes, min_area=1000, max_area=100000),
+                                  model_loader=lambda: models.get()[1])
+
+# Only look for ID cards around detected people (faster, but ID cards held
+# away from anyone's face are missed)
+CASCADE_ID_DETECTION = False
+
+# Another face must be the biggest for this many frames to become the speaker
+SPEAKER_SWITCH_FRAMES = 15
+
+# How each class is hidden: gaussian, box, pixelate, resize or fill
+# (run "python redaction.py" to compare their speed)
+FACE_KERNEL = make_kernel('gaussian', 23, sigma=30)
+ID_KERNEL = make_kernel('gaussian', 51, sigma=50)
+
+# Longest /set_camera waits for a camera to answer (seconds)
+CAMERA_OPEN_TIMEOUT = 5.0
+# The connection opened to test a camera is kept this long for its stream
+capture_pool = CapturePool(CAMERA_OPEN_TIMEOUT)
+
+# threaded = Flask, one thread per viewer; asgi = uvicorn, thousands of viewers
+SERVER_MODE = 'threaded'
+
+# Skip the AI and the encode when the scene hasn't changed
+SKIP_UNCHANGED_FRAMES = True
+
+# JPEG encoder: auto, turbojpeg, pil or opencv (runs on a shared worker pool)
+encoder_pool = default_pool('auto')
 
-# Global variable to store camera URL
-current_camera_url = None
 
 # HTML Template - The entire website in one string!
 HTML_TEMPLATE = """
@@ -145,7 +216,7 @@ HTML_TEMPLATE = """
             <button class="stop-btn" onclick="stopCamera()">⏹️ Stop Stream</button>
             
             <div style="margin-top: 20px;">
-                <img id="videoStream" src="/video_feed" style="display: none;">
+                <img id="videoStream" src="" style="display: none;">
             </div>
             
             <div class="info-box">
@@ -159,6 +230,8 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
+        let cameraId = null;
+
         function startCamera() {
             const url = document.getElementById('cameraUrl').value;
             
@@ -176,9 +249,10 @@ HTML_TEMPLATE = """
             .then(response => response.json())
             .then(data => {
                 if (data.status === 'success') {
+                    cameraId = data.camera_id;
                     document.getElementById('videoContainer').classList.add('active');
                     document.getElementById('videoStream').style.display = 'block';
-                    document.getElementById('videoStream').src = '/video_feed?' + new Date().getTime();
+                    document.getElementById('videoStream').src = '/video_feed/' + cameraId + '?' + new Date().getTime();
                     document.getElementById('status').textContent = '🟢 Live - Processing frames...';
                     document.getElementById('status').style.background = '#10b981';
                 } else {
@@ -191,8 +265,13 @@ HTML_TEMPLATE = """
         }
 
         function stopCamera() {
-            fetch('/stop_camera', {method: 'POST'})
+            fetch('/stop_camera', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({camera_id: cameraId})
+            })
             .then(() => {
+                cameraId = null;
                 document.getElementById('videoContainer').classList.remove('active');
                 document.getElementById('videoStream').style.display = 'none';
                 document.getElementById('status').textContent = 'Stopped';
@@ -204,105 +283,92 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def process_frame(frame):
-    """Process frame with face and ID card detection"""
-    output = frame.copy()
+def process_frame(speaker, frame, output=None):
+    """Process frame with face and ID card detection.
+    speaker is the camera's SpeakerSelector, output an optional reused buffer to draw into."""
+    output = copy_into(frame, output)
+    start = time.perf_counter()
+    
+    # Start both detectors at once - they run in parallel on their own threads
+    face_future = face_scheduler.submit(frame, conf=0.3)
+    if not CASCADE_ID_DETECTION:
+        id_future = idcard_scheduler.submit(frame, conf=0.5)
     
     # Detect faces
-    results_face = model_face.predict(source=frame, conf=0.3, verbose=False)
-    face_boxes = []
+    face_boxes = face_future.result()
+    metrics.record('face_detect', time.perf_counter() - start)
+    
+    # Find the main speaker (same person across frames)
+    speaker_index = speaker.update(face_boxes)
     
-    for r in results_face:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            face_boxes.append((x1, y1, x2, y2))
+    # Detect ID cards (unrealistic sizes are already skipped)
+    if CASCADE_ID_DETECTION:
+        regions = upper_body_regions(face_boxes, frame.shape)
+        id_boxes = detect_in_regions(idcard_scheduler, frame, regions, conf=0.5)
+    else:
+        id_boxes = id_future.result()
+    metrics.record('id_detect', time.perf_counter() - start)  # Both models overlap
+    metrics.count('faces', len(face_boxes))
+    metrics.count('id_cards', len(id_boxes))
     
-    # Find largest face (main speaker)
-    largest_box = None
-    if face_boxes:
-        largest_box = max(face_boxes, key=lambda b: (b[2]-b[0])*(b[3]-b[1]))
+    # Blur background people and ID cards - one pass per class
+    start = time.perf_counter()
+    background = [b for i, b in enumerate(face_boxes) if i != speaker_index]
+    redact_regions(output, [(background, FACE_KERNEL), (id_boxes, ID_KERNEL)])
     
-    # Process faces
-    for (x1, y1, x2, y2) in face_boxes:
-        if largest_box and (x1, y1, x2, y2) == largest_box:
+    # Draw face boxes
+    for i, (x1, y1, x2, y2) in enumerate(face_boxes):
+        if i == speaker_index:
             # Main speaker - green box
             cv2.rectangle(output, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(output, "Speaker", (x1, y1 - 10),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         else:
-            # Background person - blur and red box
-            roi = output[y1:y2, x1:x2]
-            if roi.size > 0:
-                roi_blur = cv2.GaussianBlur(roi, (23, 23), 30)
-                output[y1:y2, x1:x2] = roi_blur
+            # Background person - red box
             cv2.rectangle(output, (x1, y1), (x2, y2), (0, 0, 255), 2)
             cv2.putText(output, "Person", (x1, y1 - 10),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
     
-    # Detect ID cards
-    results_id = model_idcard.predict(source=frame, conf=0.5, verbose=False)
-    
-    for r in results_id:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            w, h = x2 - x1, y2 - y1
-            area = w * h
-            
-            # Skip unrealistic sizes
-            if area < 1000 or area > 100000:
-                continue
-            
-            # Blur ID card
-            roi = output[y1:y2, x1:x2]
-            if roi.size > 0:
-                roi_blur = cv2.GaussianBlur(roi, (51, 51), 50)
-                output[y1:y2, x1:x2] = roi_blur
-            
-            cv2.rectangle(output, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            cv2.putText(output, f"ID Card", (x1, y1 - 10),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+    # Draw ID card boxes
+    for (x1, y1, x2, y2) in id_boxes:
+        cv2.rectangle(output, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(output, f"ID Card", (x1, y1 - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+    metrics.record('redact', time.perf_counter() - start)
     
     return output
 
-def generate_frames():
+def make_processor():
+    """Processing for one camera - each camera remembers its own speaker.
+    With PROCESS_WORKERS this runs inside a worker process."""
+    return partial(process_frame, SpeakerSelector(SPEAKER_SWITCH_FRAMES))
+
+worker_pool = None
+
+def get_worker_pool():
+    """The worker processes, started when the first camera needs them"""
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = ProcessWorkerPool('simple_camera_app:make_processor', PROCESS_WORKERS,
+                                        THREADS_PER_WORKER)
+    return worker_pool
+
+def make_pipeline(url):
+    """Build the capture + AI pipeline for one camera (models are shared)"""
+    process = get_worker_pool().processor() if PROCESS_WORKERS else make_processor()
+    change_detector = ChangeDetector() if SKIP_UNCHANGED_FRAMES else None
+    return FramePipeline(url, process,
+                         (640, 480), jpeg_quality=85, encoder=encoder_pool,
+                         change_detector=change_detector, capture_pool=capture_pool)
+
+# Every camera gets its own ID and pipeline
+cameras = CameraManager(make_pipeline)
+
+def generate_frames(camera):
     """Generate video frames from IP camera"""
-    global current_camera_url
-    
-    if not current_camera_url:
-        return
-    
-    cap = cv2.VideoCapture(current_camera_url)
-    
-    if not cap.isOpened():
-        print(f"Error: Cannot open camera URL: {current_camera_url}")
-        return
-    
-    print(f"Successfully connected to camera: {current_camera_url}")
-    
-    try:
-        while current_camera_url:  # Keep streaming while URL is set
-            ret, frame = cap.read()
-            if not ret:
-                print("Error reading frame")
-                break
-            
-            # Resize for faster processing
-            frame = cv2.resize(frame, (640, 480))
-            
-            # Process with AI
-            output = process_frame(frame)
-            
-            # Encode to JPEG
-            _, buffer = cv2.imencode('.jpg', output, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            frame_bytes = buffer.tobytes()
-            
-            # Yield frame in multipart format
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-    finally:
-        cap.release()
-        print("Camera released")
+    # One capture + AI pipeline per camera is shared by every viewer,
+    # and its chunks arrive already wrapped in the multipart format
+    yield from camera.stream()
 
 @app.route('/')
 def index():
@@ -311,41 +377,87 @@ def index():
 
 @app.route('/set_camera', methods=['POST'])
 def set_camera():
-    """Set the camera URL"""
-    global current_camera_url
-    
+    """Register a camera URL and return its camera ID"""
     data = request.json
     url = data.get('url', '')
     
     if not url:
         return jsonify({'status': 'error', 'message': 'No URL provided'})
     
-    # Test the URL
-    test_cap = cv2.VideoCapture(url)
-    if not test_cap.isOpened():
-        test_cap.release()
+    # Test the URL - gives up after CAMERA_OPEN_TIMEOUT, and the stream
+    # reuses the connection instead of opening the camera again
+    if not capture_pool.probe(url):
         return jsonify({'status': 'error', 'message': 'Cannot connect to camera URL'})
-    test_cap.release()
     
-    current_camera_url = url
-    print(f"Camera URL set to: {url}")
+    camera = cameras.add(url)
+    print(f"Camera {camera.id} set to: {url}")
     
-    return jsonify({'status': 'success', 'message': 'Camera connected'})
+    return jsonify({'status': 'success', 'message': 'Camera connected', 'camera_id': camera.id})
 
 @app.route('/stop_camera', methods=['POST'])
 def stop_camera():
-    """Stop the camera"""
-    global current_camera_url
-    current_camera_url = None
+    """Stop one camera (or all cameras if no ID is given)"""
+    data = request.get_json(silent=True) or {}
+    camera_id = data.get('camera_id')
+    
+    if camera_id:
+        if not cameras.remove(camera_id):
+            return jsonify({'status': 'error', 'message': 'Unknown camera ID'}), 404
+    else:
+        cameras.remove_all()
     print("Camera stopped")
     return jsonify({'status': 'success'})
 
+@app.route('/cameras')
+def list_cameras():
+    """List registered cameras, with buffer pool and memory stats"""
+    return jsonify({'status': 'success', 'cameras': cameras.list(),
+                    'rss_bytes': rss_bytes()})
+
+@app.route('/stats')
+def stats():
+    """Per-stream timings, fps, counters and queue depths as JSON"""
+    return jsonify({'status': 'success', 'streams': cameras.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """The same numbers in Prometheus text format"""
+    return Response(metrics.render_prometheus(cameras.stats()),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/status')
+def status():
+    """Whether the models are loaded yet"""
+    return jsonify({'status': 'success', 'models': models.status()})
+
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id):
+    """Video streaming route for one camera"""
+    camera = cameras.get(camera_id)
+    if camera is None:
+        return jsonify({'status': 'error', 'message': 'Unknown camera ID'}), 404
+    return Response(generate_frames(camera),
+                   mimetype='multipart/x-mixed-replace; boundary=frame')
+
 @app.route('/video_feed')
-def video_feed():
-    """Video streaming route"""
-    return Response(generate_frames(),
+def latest_video_feed():
+    """Stream the most recently added camera"""
+    camera = cameras.latest()
+    if camera is None:
+        return jsonify({'status': 'error', 'message': 'No camera set'}), 404
+    return Response(generate_frames(camera),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
+# The same routes for an asyncio server: uvicorn simple_camera_app:asgi_app
+asgi_app = make_asgi_app(HTML_TEMPLATE, cameras, capture_pool, {
+    '/cameras': lambda: {'status': 'success', 'cameras': cameras.list(),
+                         'rss_bytes': rss_bytes()},
+    '/status': lambda: {'status': 'success', 'models': models.status()},
+    '/stats': lambda: {'status': 'success', 'streams': cameras.stats()},
+}, text_routes={
+    '/metrics': lambda: metrics.render_prometheus(cameras.stats()),
+})
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("🔒 Privacy Blur - IP Camera Web App")
@@ -355,4 +467,8 @@ if __name__ == '__main__':
     print("🎬 Enter your IP camera URL and click 'Start Stream'")
     print("\n⏹️  Press Ctrl+C to stop\n")
     
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    if SERVER_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,178 @@
+"""
+Box Tracking
+Full YOLO detection is expensive, so it only runs every K frames. In between,
+the BoxTracker moves the last detected boxes along with the scene using sparse
+optical flow (Lucas-Kanade), so every frame still gets blurred.
+Faces also get stable track IDs, so the unblurred speaker stays the same
+person from frame to frame.
+"""
+
+import cv2
+import numpy as np
+
+LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+def box_points(box, grid=4):
+    """A grid of points inside a box to follow with optical flow"""
+    x1, y1, x2, y2 = box
+    xs = np.linspace(x1, x2, grid + 2, dtype=np.float32)[1:-1]
+    ys = np.linspace(y1, y2, grid + 2, dtype=np.float32)[1:-1]
+    return np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+
+
+class BoxTracker:
+    """Moves the last detected boxes with the scene between detections"""
+
+    def __init__(self, grid=4, grow=0.02):
+        self.grid = grid
+        self.grow = grow  # Boxes get a bit bigger each tracked frame, to be safe
+        self.prev_gray = None
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+
+    def reset(self, frame, boxes):
+        """Start tracking fresh detections"""
+        self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+    def update(self, frame):
+        """Move every box to where it is in this frame. Returns int boxes"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if self.prev_gray is not None and len(self.boxes):
+            # Track the points of all boxes in a single optical flow call
+            points = np.concatenate([box_points(b, self.grid) for b in self.boxes])
+            owner = np.repeat(np.arange(len(self.boxes)), self.grid * self.grid)
+
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                self.prev_gray, gray, points.reshape(-1, 1, 2), None, **LK_PARAMS)
+            moved = new_points.reshape(-1, 2) - points
+            good = status.reshape(-1) == 1
+
+            for i in range(len(self.boxes)):
+                mask = good & (owner == i)
+                if mask.any():
+                    dx, dy = np.median(moved[mask], axis=0)
+                    self.boxes[i] += (dx, dy, dx, dy)
+
+            # Grow the boxes a little, since tracking is less exact than detection
+            w = self.boxes[:, 2] - self.boxes[:, 0]
+            h = self.boxes[:, 3] - self.boxes[:, 1]
+            pad = np.stack([-w, -h, w, h], axis=1) * (self.grow / 2)
+            self.boxes += pad
+
+            height, width = gray.shape
+            self.boxes[:, [0, 2]] = np.clip(self.boxes[:, [0, 2]], 0, width)
+            self.boxes[:, [1, 3]] = np.clip(self.boxes[:, [1, 3]], 0, height)
+
+        self.prev_gray = gray
+        return [tuple(int(v) for v in box) for box in self.boxes]
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU between every box in boxes_a (N x 4) and boxes_b (M x 4), as N x M"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(1, -1, 4)
+
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+class FaceTracker:
+    """Gives each face a track ID that stays the same across frames.
+    Faces are matched to the previous frame's tracks by IoU."""
+
+    def __init__(self, iou_threshold=0.3, max_missed=10):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed  # Frames a track survives without a match
+        self.track_ids = np.zeros(0, dtype=np.int64)
+        self.track_boxes = np.zeros((0, 4), dtype=np.float32)
+        self.missed = np.zeros(0, dtype=np.int64)
+        self.next_id = 0
+
+    def update(self, boxes):
+        """Match this frame's boxes to tracks. Returns one track ID per box"""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        ids = np.full(len(boxes), -1, dtype=np.int64)
+        matched_tracks = np.zeros(len(self.track_ids), dtype=bool)
+
+        if len(boxes) and len(self.track_ids):
+            iou = iou_matrix(boxes, self.track_boxes)
+
+            # Greedy matching, best IoU first
+            order = np.argsort(iou, axis=None)[::-1]
+            rows, cols = np.unravel_index(order, iou.shape)
+            for r, c in zip(rows, cols):
+                if iou[r, c] < self.iou_threshold:
+                    break
+                if ids[r] == -1 and not matched_tracks[c]:
+                    ids[r] = self.track_ids[c]
+                    matched_tracks[c] = True
+
+        # New faces get new track IDs
+        new = ids == -1
+        ids[new] = np.arange(self.next_id, self.next_id + new.sum())
+        self.next_id += int(new.sum())
+
+        # Keep unmatched tracks around for a few frames in case they come back
+        self.missed = self.missed + 1
+        self.missed[matched_tracks] = 0
+        keep = ~matched_tracks & (self.missed <= self.max_missed)
+
+        self.track_ids = np.concatenate([ids, self.track_ids[keep]])
+        self.track_boxes = np.concatenate([boxes, self.track_boxes[keep]])
+        self.missed = np.concatenate([np.zeros(len(ids), dtype=np.int64), self.missed[keep]])
+        return ids
+
+
+class SpeakerSelector:
+    """Picks the main speaker (the face left unblurred) by track ID.
+    The speaker only changes once another face has been the largest for
+    switch_frames frames in a row, so a bystander who is briefly bigger
+    never gets unblurred."""
+
+    def __init__(self, switch_frames=15, iou_threshold=0.3):
+        self.switch_frames = switch_frames
+        self.tracker = FaceTracker(iou_threshold)
+        self.speaker_id = None
+        self.candidate_id = None
+        self.candidate_frames = 0
+
+    def update(self, face_boxes):
+        """Returns the index of the speaker in face_boxes, or None"""
+        ids = self.tracker.update(face_boxes)
+        if len(ids) == 0:
+            self.candidate_id = None
+            self.candidate_frames = 0
+            return None
+
+        boxes = np.asarray(face_boxes, dtype=np.float32).reshape(-1, 4)
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        largest_id = int(ids[np.argmax(areas)])
+
+        if self.speaker_id is None:
+            self.speaker_id = largest_id
+        elif largest_id != self.speaker_id:
+            # Someone else is the biggest face - count how long for
+            if largest_id == self.candidate_id:
+                self.candidate_frames += 1
+            else:
+                self.candidate_id = largest_id
+                self.candidate_frames = 1
+            if self.candidate_frames >= self.switch_frames:
+                self.speaker_id = largest_id
+                self.candidate_id = None
+                self.candidate_frames = 0
+        else:
+            self.candidate_id = None
+            self.candidate_frames = 0
+
+        matches = np.flatnonzero(ids == self.speaker_id)
+        return int(matches[0]) if len(matches) else None
@@ -0,0 +1,170 @@
+"""
+Process Workers
+On CPU-only machines every stream in one process fights over the GIL in the
+box loops, blurs and ultralytics post-processing. A ProcessWorkerPool runs
+detection + redaction in separate worker processes instead, each with its own
+copy of the models and a share of the CPU cores.
+
+Frames are never pickled or copied: the worker attaches to the stream's
+SharedFrameRing and reads the input slot / writes the output slot in place.
+Only the slot numbers go over the pipe. Each camera sticks to one worker, so
+per-stream state (speaker, tracker) stays in that worker process.
+"""
+
+import importlib
+import multiprocessing
+import os
+import threading
+import numpy as np
+
+import metrics
+from buffers import SharedFrameRing
+
+
+def _worker_main(factory_path, conn, threads):
+    """Worker process: build one processor per stream and run frames through it"""
+    # Limit torch to this worker's share of the cores.
+    # Must happen before the app module imports it.
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['PRIVACY_DEMO_WORKER'] = '1'
+
+    module_name, attr = factory_path.split(':')
+    factory = getattr(importlib.import_module(module_name), attr)
+
+    processors = {}
+    rings = {}  # stream_id -> the stream's attached SharedFrameRing
+    while True:
+        message = conn.recv()
+        kind = message[0]
+        recorder = metrics.FrameRecorder()  # Stage timings go back with the reply
+        metrics.bind(recorder)
+        try:
+            if kind == 'open':
+                processors[message[1]] = factory()
+            elif kind == 'frame':
+                _, stream_id, ring_info, in_slot, out_slot, shape, values = message
+                ring = rings.get(stream_id)
+                if ring is None or ring.name != ring_info[0]:
+                    if ring is not None:
+                        ring.close()
+                    ring = rings[stream_id] = SharedFrameRing.attach(*ring_info)
+                processor = processors[stream_id]
+                if values is not None:
+                    processor.settings.load(values)  # The stream's live settings for this frame
+                output = ring.frame(out_slot, shape)
+                result = processor(ring.frame(in_slot, shape), output)
+                if result is not output:
+                    np.copyto(output, result)
+                output = result = None  # Views must go before the ring is closed
+            elif kind == 'close':
+                processors.pop(message[1], None)
+                ring = rings.pop(message[1], None)
+                if ring is not None:
+                    ring.close()
+            elif kind == 'stop':
+                break
+            conn.send(('ok', recorder.items))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+    for ring in rings.values():
+        ring.close()
+
+
+class ProcessWorker:
+    """One worker process and the pipe to it"""
+
+    def __init__(self, context, factory_path, threads):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, daemon=True,
+                                       args=(factory_path, child_conn, threads))
+        self.process.start()
+        self.lock = threading.Lock()  # One request in flight per worker
+        self.streams = 0
+
+    def call(self, message):
+        """Send one message and wait for the worker's answer.
+        Timings the worker recorded are added to this thread's stream metrics."""
+        with self.lock:
+            self.conn.send(message)
+            reply = self.conn.recv()
+        if reply[0] == 'error':
+            raise RuntimeError(f"Worker failed: {reply[1]}")
+        metrics.replay(reply[1])
+
+    def stop(self):
+        with self.lock:
+            try:
+                self.conn.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class WorkerStream:
+    """Processor for one camera that runs inside a worker process.
+    The pipeline calls process_slots() with ring slots instead of arrays."""
+
+    def __init__(self, pool, worker, stream_id, settings=None):
+        self.pool = pool
+        self.worker = worker
+        self.stream_id = stream_id
+        self.settings = settings  # Sent along with every frame
+        self.closed = False
+
+    def process_slots(self, ring, in_slot, out_slot, shape=None):
+        """Run the frame in in_slot through the worker, result lands in out_slot"""
+        ring_info = (ring.name, ring.shape, ring.slots, ring.dtype.str)
+        values = self.settings.snapshot() if self.settings else None
+        self.worker.call(('frame', self.stream_id, ring_info, in_slot, out_slot, shape, values))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.pool.release(self)
+
+
+class ProcessWorkerPool:
+    """Worker processes running detection + redaction off the GIL.
+    factory_path is "module:function"; the function runs inside each worker
+    and returns a new processor for one stream."""
+
+    def __init__(self, factory_path, workers=None, threads_per_worker=1):
+        cores = os.cpu_count() or 2
+        self.workers_count = workers or max(cores // threads_per_worker, 1)
+        # spawn, not fork: the parent has capture and encoder threads running
+        context = multiprocessing.get_context('spawn')
+        self.workers = [ProcessWorker(context, factory_path, threads_per_worker)
+                        for _ in range(self.workers_count)]
+        self.next_id = 0
+        self.lock = threading.Lock()
+        print(f"Started {self.workers_count} inference worker processes "
+              f"({threads_per_worker} threads each)")
+
+    def processor(self, settings=None):
+        """A processor for a new stream, on the least busy worker.
+        The worker's processor gets the stream's live settings with each frame."""
+        with self.lock:
+            worker = min(self.workers, key=lambda w: w.streams)
+            worker.streams += 1
+            self.next_id += 1
+            stream_id = self.next_id
+        worker.call(('open', stream_id))
+        return WorkerStream(self, worker, stream_id, settings)
+
+    def release(self, stream):
+        """Forget a stream's state in its worker"""
+        with self.lock:
+            stream.worker.streams -= 1
+        stream.worker.call(('close', stream.stream_id))
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+def in_worker():
+    """True inside a worker process (so apps don't start another pool there)"""
+    return os.environ.get('PRIVACY_DEMO_WORKER') == '1'